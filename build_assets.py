@@ -0,0 +1,9 @@
+from scripts.image_cache import ImageCache
+from scripts.utils import BASE_IMG_PATH
+
+# Decodes every image into the image cache ahead of time, launches otherwise
+# fill it as they go, e.g:
+#   python3 build_assets.py
+cache = ImageCache()
+cache.build(BASE_IMG_PATH, colorkey=(0, 0, 0))
+cache.save()
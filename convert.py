@@ -0,0 +1,8 @@
+import sys
+
+from scripts.mapfile import convert
+
+# Converts a map between the JSON and binary formats, the format of the
+# destination is picked by its extension, e.g:
+#   python3 convert.py data/maps/0.json data/maps/0.dmap
+convert(sys.argv[1], sys.argv[2])
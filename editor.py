@@ -4,13 +4,17 @@ import pygame
 
 from instance import Instance
 from scripts.assets import AssetTile
+from scripts.render_queue import Layer
 from scripts.tile import Tile
 from scripts.utils import Key, Mouse, Vec2
 
 
 class Editor(Instance):
     def __init__(self):
-        super().__init__(title='editor', res_base=(320, 180), res_scale=3.0)
+        super().__init__(title='editor', res_base=(320, 180), res_scale=3.0, native='--native' in sys.argv,
+                         max_fps=60)
+        # Every tile can be picked, so all of them are decoded up front.
+        self.assets.prefetch(AssetTile)
 
         self.binds = (
             Key((pygame.K_a, pygame.K_LEFT), lambda: self.dir.toggle_left(), lambda: self.dir.toggle_left()),
@@ -19,8 +23,11 @@ class Editor(Instance):
             Key((pygame.K_s, pygame.K_DOWN), lambda: self.dir.toggle_down(), lambda: self.dir.toggle_down()),
             Key(pygame.K_g, lambda: self.toggle_ongrid()),
             Key(pygame.K_t, lambda: self.tilemap.automap()),
+            Key(pygame.K_y, lambda: self.toggle_autotile()),
             Key(pygame.K_o, lambda: self.tilemap.save('map.json')),
             Key(pygame.K_TAB, lambda: self.scroll_tile_type(1)),
+            Key(pygame.K_F1, lambda: self.toggle_outline()),
+            Key(pygame.K_F2, lambda: self.toggle_stats()),
             Mouse(1, lambda: self.toggle_click(), lambda: self.toggle_click()),
             Mouse(3, lambda: self.toggle_r_click(), lambda: self.toggle_r_click()),
             Mouse(4, lambda: self.scroll_tile_var(1)),
@@ -36,6 +43,10 @@ class Editor(Instance):
         self.click = False
         self.r_click = False
         self.ongrid = True
+        # The editor is left open for long stretches, so only what changed
+        # is redrawn.
+        self.dirty_mode = True
+        self.preview_state = None
         try:
             self.tilemap.load('map.json')
         except FileNotFoundError:
@@ -45,7 +56,7 @@ class Editor(Instance):
         self.click = not self.click
         # This prevents accidental placement of multiple instances.
         if self.click and not self.ongrid:
-            self.tilemap.offgrid.append(Tile(self.tile_type, self.tile_var, self.mpos.add(self.scroll)))
+            self.tilemap.place_offgrid(Tile(self.tile_type, self.tile_var, self.mpos.add(self.camera.scroll)))
 
     def toggle_r_click(self):
         self.r_click = not self.r_click
@@ -53,6 +64,9 @@ class Editor(Instance):
     def toggle_ongrid(self):
         self.ongrid = not self.ongrid
 
+    def toggle_autotile(self):
+        self.tilemap.autotiler.live = not self.tilemap.autotiler.live
+
     def scroll_tile_type(self, amount):
         self.tile_group = (self.tile_group + amount) % len(AssetTile)
         self.tile_type = tuple(AssetTile)[self.tile_group]
@@ -63,56 +77,81 @@ class Editor(Instance):
 
     def run(self):
         while True:
-            # Order is important here!
-            self.clear()
+            # Order is important here! Everything that changes the display
+            # runs before drawing, so that the changes are known.
+            self.handle_events()
             self.handle_scroll()
-            self.handle_tilemap()
             self.handle_positions()
-            self.handle_tile_preview()
             self.handle_tile_placement()
             self.handle_tile_removal()
-            self.handle_events()
+            self.handle_preview_state()
+
+            if self.is_dirty():
+                self.clear()
+                self.handle_tilemap()
+                self.handle_tile_preview()
+
             self.render()
 
     def handle_scroll(self):
-        self.scroll = self.scroll.add(((self.dir.right - self.dir.left) * 5, (self.dir.down - self.dir.up) * 5))
-        self.render_scroll = self.scroll.int()
+        scroll = self.camera.scroll.add(((self.dir.right - self.dir.left) * 5, (self.dir.down - self.dir.up) * 5))
+
+        if scroll.tuple() != self.camera.scroll.tuple():
+            self.invalidate()
+
+        self.camera.move(scroll)
 
     def handle_tilemap(self):
         self.tilemap.render()
 
     def handle_positions(self):
-        self.mpos = Vec2(pygame.mouse.get_pos()).div(self.RES_SCALE)
-        self.tile_pos = (self.mpos.add(self.scroll).div_f(self.tilemap.size).int())
+        self.mpos = Vec2(self.presenter.mouse_pos())
+        self.tile_pos = (self.mpos.add(self.camera.scroll).div_f(self.tilemap.size).int())
+
+    def preview_rects(self):
+        img = self.assets.get_tiles(self.tile_type, self.tile_var)
+
+        if self.ongrid:
+            pos = self.tile_pos.mult(self.tilemap.size).sub(self.camera.scroll)
+        else:
+            pos = self.mpos
+
+        return (pygame.Rect(int(pos.x), int(pos.y), *img.get_size()), pygame.Rect(5, 5, *img.get_size()))
+
+    def handle_preview_state(self):
+        # Redraws where the preview was and where it is now, when it moved
+        # or changed tile.
+        state = (self.tile_type, self.tile_var, self.preview_rects())
+
+        if state != self.preview_state:
+            for rect in state[2] + (self.preview_state[2] if self.preview_state else ()):
+                self.invalidate(rect)
+
+            self.preview_state = state
 
     def handle_tile_preview(self):
         current_tile_img = self.assets.get_tiles(self.tile_type, self.tile_var).copy()
         current_tile_img.set_alpha(155)
 
+        # The preview is a translucent copy, so it is outlined at the end of
+        # the frame rather than cached.
         if self.ongrid:
-            self.fore_d.blit(current_tile_img, self.tile_pos.mult(self.tilemap.size).sub(self.scroll).tuple())
+            self.draw_uncached(current_tile_img, self.tile_pos.mult(self.tilemap.size).sub(self.camera.scroll).tuple(), Layer.PREVIEW)
         else:
-            self.fore_d.blit(current_tile_img, self.mpos.tuple())
+            self.draw_uncached(current_tile_img, self.mpos.tuple(), Layer.PREVIEW)
 
-        self.fore_d.blit(current_tile_img, (5, 5))
+        self.draw_uncached(current_tile_img, (5, 5), Layer.PREVIEW)
 
     def handle_tile_placement(self):
         if self.click and self.ongrid:
-            self.tilemap.tilemap[self.tile_pos.json()] = Tile(self.tile_type, self.tile_var, self.tile_pos)
+            self.tilemap.place(Tile(self.tile_type, self.tile_var, self.tile_pos))
 
     def handle_tile_removal(self):
         if self.r_click:
-            tile_loc = self.tile_pos.json()
-
-            if tile_loc in self.tilemap.tilemap:
-                del self.tilemap.tilemap[tile_loc]
-
-            for tile in self.tilemap.offgrid.copy():
-                tile_img = self.assets.get_tiles(tile.type, tile.var)
-                tile_r = pygame.Rect(*tile.pos.sub(self.scroll), *tile_img.get_size())
+            self.tilemap.remove(*self.tile_pos)
 
-                if tile_r.collidepoint(self.mpos.tuple()):
-                    self.tilemap.offgrid.remove(tile)
+            for tile in self.tilemap.offgrid_at(self.mpos.add(self.camera.scroll).tuple()):
+                self.tilemap.remove_offgrid(tile)
 
     def handle_events(self):
         for event in pygame.event.get():
@@ -125,6 +164,8 @@ class Editor(Instance):
         if event.type == pygame.QUIT:
             pygame.quit()
             sys.exit()
+        elif event.type == pygame.WINDOWEXPOSED:
+            self.invalidate()
 
 
 Editor().run()
@@ -7,48 +7,74 @@ import pygame
 from instance import Instance
 from scripts.assets import AssetAnim, AssetLayer, AssetSprite, AssetTile
 from scripts.clouds import Clouds
-from scripts.entities import Enemy, Player
-from scripts.particle import PartFactory, ParticleSpawner
+from scripts.entities import RENDER_MARGIN, Enemy, Player
+from scripts.particle import PartFactory, Particles, ParticleSpawner
+from scripts.projectile import PROJ_LIFETIME
+from scripts.render_queue import Layer
 from scripts.sounds import SoundAmbience, SoundEffect, SoundMusic, Sounds
-from scripts.spark import SparkFactory
+from scripts.spark import SparkFactory, Sparks
+from scripts.transition import CircleWipe
 from scripts.utils import Key, Vec2, get_rects
 
 
 class Game(Instance):
     def __init__(self):
-        super().__init__(title='python', res_base=(320, 180), res_scale=3.0)
+        super().__init__(title='python', res_base=(320, 180), res_scale=3.0, native='--native' in sys.argv)
+        self.level = 0
 
         self.binds = (
             Key((pygame.K_a, pygame.K_LEFT), lambda: self.dir.toggle_left(), lambda: self.dir.toggle_left()),
             Key((pygame.K_d, pygame.K_RIGHT), lambda: self.dir.toggle_right(), lambda: self.dir.toggle_right()),
             Key((pygame.K_SPACE, pygame.K_UP), lambda: self.player.jump()),
-            Key(pygame.K_LSHIFT, lambda: self.player.dash())
+            Key(pygame.K_LSHIFT, lambda: self.player.dash()),
+            Key(pygame.K_F1, lambda: self.toggle_outline()),
+            Key(pygame.K_F2, lambda: self.toggle_stats())
         )
 
+        # Decoded on a worker while the rest starts up.
+        self.assets.prefetch((*AssetAnim, *AssetSprite))
+        self.prefetch_level(self.level)
         self.sounds = Sounds()
-        self.clouds = Clouds(self.assets.get_layers(AssetLayer.CLOUD), count=16)
-        self.level = 0
+        self.set_background(self.assets.get_layers(AssetLayer.BACKGROUND, 0))
+        self.clouds = Clouds(self.assets.get_layers(AssetLayer.CLOUD), self.back_d.get_size(), count=16)
+        self.parts = Particles(self.assets)
+        self.parts.sway(AssetAnim.PARTICLE_LEAF, speed=Vec2((0.035, 0)), amp=Vec2((0.3, 0)))
+        # Frames are prepared for the resolution of the display.
+        self.transition_fx = CircleWipe(self.fore_d.get_size())
+        # Only binary maps are streamed, JSON maps stay fully resident.
+        self.tilemap.stream(radius=2)
 
     def run(self):
         self.load_level(self.level)
         self.sounds.load_music(SoundMusic.MUSIC, 0.5)
         self.sounds.get_ambient(SoundAmbience.AMBIENCE).play(-1)
 
-        while True:
-            # Order is important here!
-            self.clear()
-            self.handle_game_state()
-            self.handle_scroll()
-            self.handle_clouds()
-            self.handle_tilemap()
-            self.handle_enemies()
-            self.handle_player()
-            self.handle_projs()
-            self.handle_sparks()
-            self.handle_parts()
-            self.handle_transition()
-            self.handle_events()
-            self.render()
+        self.loop(self.update, self.draw_frame)
+
+    def update(self):
+        # One tick of the simulation. Order is important here!
+        self.handle_events()
+        self.handle_game_state()
+        self.handle_scroll()
+        self.clouds.update()
+        self.tilemap.update()
+        self.handle_enemies()
+        self.handle_player()
+        self.handle_projs()
+        self.sparks.update()
+        self.leaf_spawner.update()
+        self.parts.update()
+
+    def draw_frame(self):
+        self.clear()
+        self.clouds.render(self.queue, self.back_d, offset=self.camera.render_scroll)
+        self.tilemap.render()
+        self.render_enemies()
+        self.render_player()
+        self.render_projs()
+        self.sparks.render(self, offset=self.camera.render_scroll)
+        self.parts.render(self, offset=self.camera.render_scroll)
+        self.render_transition()
 
     def load_level(self, map_id):
         super().load_level(map_id)
@@ -57,23 +83,19 @@ class Game(Instance):
 
         self.player = Player(self, (8, 15), Vec2((0, 0)))
         self.enemies = []
-        self.parts = []
+        self.parts.clear()
         self.projs = []
-        self.sparks = []
+        self.sparks = Sparks()
         self.transition = -30
         self.handle_spawners()
 
     def handle_spawners(self):
         for spawn in self.tilemap.extract([(AssetTile.SPAWNERS, 0), (AssetTile.SPAWNERS, 1)]):
             if spawn.var == 0:
-                self.player.pos = spawn.pos
+                self.player.place(spawn.pos)
             else:
                 self.enemies.append(Enemy(self, (8, 15), spawn.pos))
 
-    def clear(self):
-        super().clear()
-        self.back_d.blit(self.assets.get_layers(AssetLayer.BACKGROUND, 0), (0, 0))
-
     def handle_game_state(self):
         if self.player.hitpoint.is_dead():
             self.transition = min(30, self.transition + 1)
@@ -84,49 +106,61 @@ class Game(Instance):
         if not len(self.enemies):
             self.transition += 1
 
+            if self.transition == 1:
+                # The next level is decoded while the transition plays.
+                self.prefetch_level(self.next_level())
+
             if self.transition > 30:
-                self.level = min(len(os.listdir('data/maps/')) - 1, self.level + 1)
+                self.level = self.next_level()
                 self.load_level(self.level)
 
         if self.transition < 0:
             self.transition += 1
 
-    def handle_scroll(self):
-        self.scroll = self.scroll.add(
-            ((self.player.rect().centerx - self.fore_d.get_width() / 2 - self.scroll.x) / 30,
-             (self.player.rect().centery - self.fore_d.get_height() / 2 - self.scroll.y) / 30)
-        )
-        self.render_scroll = self.scroll.int()
+    def next_level(self):
+        # A level may exist in both formats, so count unique ids.
+        level_count = len({os.path.splitext(name)[0] for name in os.listdir('data/maps/')})
 
-    def handle_clouds(self):
-        self.clouds.update()
-        self.clouds.render(self.back_d, offset=self.render_scroll)
+        return min(level_count - 1, self.level + 1)
 
-    def handle_tilemap(self):
-        self.tilemap.render()
+    def handle_scroll(self):
+        self.camera.update()
+        self.camera.follow(self.player.rect().center)
 
     def handle_enemies(self):
+        # Enemies that shoot this tick check their line of sight in one batch.
+        aims = [(enemy, enemy.aim()) for enemy in self.enemies]
+        hits = iter(self.tilemap.raycast_batch([ray for _, ray in aims if ray]))
+
+        for enemy, ray in aims:
+            enemy.blocked = ray is not None and next(hits) is not None
+
         for enemy in self.enemies.copy():
             enemy.update(Vec2((0, 0)))
-            enemy.render()
 
             if enemy.hitpoint.is_dead():
                 self.enemies.remove(enemy)
 
+    def render_enemies(self):
+        for enemy in self.enemies:
+            if self.camera.visible(enemy.rect(), RENDER_MARGIN):
+                enemy.render()
+
     def handle_player(self):
         if not self.player.hitpoint.is_dead():
             self.player.update(Vec2((self.dir.right - self.dir.left, self.dir.down - self.dir.up)))
+
+    def render_player(self):
+        if not self.player.hitpoint.is_dead() and self.camera.visible(self.player.rect(), RENDER_MARGIN):
             self.player.render()
 
     def handle_projs(self):
         for proj in self.projs.copy():
             proj.pos = proj.pos.add(proj.vel)
             proj.timer += 1
-            img = self.assets.get_sprite(AssetSprite.PROJECTILE)
-            pos = (proj.pos.sub((img.get_width() / 2, img.get_height() / 2)).sub(self.render_scroll).tuple())
-            self.fore_d.blit(img, pos)
 
-            if self.tilemap.solid_check(proj.pos) or proj.timer > 360:
+            # The impact frame is known up front, so walls are not polled.
+            if proj.timer == proj.impact or proj.timer > PROJ_LIFETIME:
                 self.handle_proj_solid(proj)
             elif (self.player.dashing < self.player.dashing_diff and self.player.rect().collidepoint(proj.pos.tuple())):
                 self.handle_proj_hit(proj)
@@ -134,51 +168,32 @@ class Game(Instance):
     def handle_proj_solid(self, proj):
         self.projs.remove(proj)
 
-        for spark in SparkFactory.cone(proj.pos, (math.pi if proj.vel.x > 0 else 0)):
-            self.sparks.append(spark)
+        self.sparks.extend(SparkFactory.cone(proj.pos, (math.pi if proj.vel.x > 0 else 0)))
 
     def handle_proj_hit(self, proj):
         self.projs.remove(proj)
         self.sounds.get_sfx(SoundEffect.HIT).play()
-        self.shake = max(48, self.shake)
+        self.camera.shake = max(48, self.camera.shake)
         self.player.hitpoint.reduce(1)
 
-        for spark in SparkFactory.burst(Vec2(self.player.rect().center)):
-            self.sparks.append(spark)
+        self.sparks.extend(SparkFactory.burst(Vec2(self.player.rect().center)))
 
-        for part in PartFactory.burst(self, AssetAnim.PARTICLE_DARK, Vec2(self.player.rect().center)):
-            self.parts.append(part)
+        self.parts.extend(PartFactory.burst(self, AssetAnim.PARTICLE_DARK, Vec2(self.player.rect().center)))
 
-    def handle_sparks(self):
-        for spark in self.sparks.copy():
-            if not spark.update():
-                spark.render(self.fore_d, offset=self.render_scroll)
-            else:
-                self.sparks.remove(spark)
+    def render_projs(self):
+        img = self.assets.get_sprite(AssetSprite.PROJECTILE)
 
-    def handle_parts(self):
-        self.leaf_spawner.update()
-        # Could always separate entity and tile particles by creating two
-        # separate lists.
-        for part in self.parts.copy():
-            if part.asset == AssetAnim.PARTICLE_LEAF:
-                part.sin_offset(speed=Vec2((0.035, 0)), amp=Vec2((0.3, 0)))
-            if part.anim.done:
-                self.parts.remove(part)
-            else:
-                part.update()
-                part.render()
+        for proj in self.projs:
+            # Projectiles move in straight lines, so where they were in the
+            # last tick is known from their velocity.
+            pos = proj.pos.add(proj.vel.mult(self.alpha - 1)).sub((img.get_width() / 2, img.get_height() / 2))
+
+            if self.camera.visible((*pos, *img.get_size()), 1):
+                self.draw(img, pos.sub(self.camera.render_scroll).tuple(), Layer.PROJECTILES)
 
-    def handle_transition(self):
+    def render_transition(self):
         if self.transition:
-            transition_surf = pygame.Surface(self.fore_d.get_size())
-            pygame.draw.circle(
-                surface=transition_surf,
-                color=(255, 255, 255),
-                center=(self.fore_d.get_width() // 2, self.fore_d.get_height() // 2),
-                radius=(30 - abs(self.transition)) * 8)
-            transition_surf.set_colorkey((255, 255, 255))
-            self.fore_d.blit(transition_surf, (0, 0))
+            self.transition_fx.render(self, abs(self.transition))
 
     def handle_events(self):
         for event in pygame.event.get():
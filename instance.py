@@ -1,70 +1,273 @@
-import random
+import os
+import time
 from abc import ABC, abstractmethod
 
 import pygame
 
 from scripts.assets import Assets
+from scripts.camera import Camera
+from scripts.mapfile import MAP_EXT, map_types
+from scripts.presenter import Presenter
+from scripts.render_queue import RenderQueue
 from scripts.tilemap import Tilemap
-from scripts.utils import Dir, Vec2
+from scripts.utils import SILHOUETTE_OFFSETS, Dir
 
-SILHOUETTE_OFFSETS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+# Frame rate while nothing on screen changes, in dirty rect mode.
+IDLE_FPS = 10
+# The simulation advances at a fixed rate, however fast frames are drawn.
+TICK_RATE = 60
+# Ticks run within one frame to catch up at most. Beyond that the game slows
+# down, rather than falling further behind with every frame.
+MAX_TICKS = 5
 
 
 class Instance(ABC):
-    def __init__(self, title='instance', res_base=(320, 180), res_scale=2.0):
+    def __init__(self, title='instance', res_base=(320, 180), res_scale=2.0, native=False, max_fps=0):
         self.RES_SCALE = res_scale
+        self.title = title
+        # Shows the draws per layer and the present time in the caption.
+        self.stats = False
         pygame.init()
         pygame.display.set_caption(title)
         # "SRCALPHA" indicates the surface contains an alpha channel.
         self.fore_d = pygame.Surface(res_base, pygame.SRCALPHA)
         self.back_d = pygame.Surface(res_base)
-        self.screen = pygame.display.set_mode((res_base[0] * res_scale, res_base[1] * res_scale))
+        # Drawn at the start of every frame, see set_background().
+        self.background = None
+        self.background_opaque = False
+        self.presenter = Presenter(res_base, res_scale, native)
+        self.screen = self.presenter.screen
         self.clock = pygame.time.Clock()
+        # Zero leaves the frame rate uncapped.
+        self.max_fps = max_fps
+        # How far the current frame is into the current tick, from 0 to 1.
+        # Moving things are drawn between where they were in the last two
+        # ticks by it.
+        self.alpha = 1
+        # In dirty rect mode only the changed areas of the display are redrawn
+        # and presented, and nothing at all when nothing changed.
+        self.dirty_mode = False
+        self.dirty_full = True
+        self.dirty_rects = []
 
         self.dir = Dir()
         self.assets = Assets()
         self.tilemap = Tilemap(self, size=16)
-        self.shake = 0
-        self.scroll = Vec2((0, 0))
-        self.render_scroll = Vec2((0, 0))
+        self.camera = Camera(res_base)
+        # Sprites and tile chunks carry cached outlines, only what is drawn
+        # without one is outlined at the end of the frame. The legacy path
+        # outlines the whole foreground every frame instead.
+        self.outline_cached = True
+        self.outline_rects = []
+        # Draws are collected by layer and submitted in batches, see flush().
+        self.queue = RenderQueue()
 
     @abstractmethod
     def run(self):
         raise NotImplementedError
 
+    def loop(self, update, draw):
+        # Runs update at TICK_RATE and draw once per frame. Slow frames are
+        # caught up with several ticks, fast frames may run none at all.
+        tick = 1 / TICK_RATE
+        lag = 0
+        last = time.perf_counter()
+
+        while True:
+            now = time.perf_counter()
+            lag += now - last
+            last = now
+            ticks = 0
+
+            while lag >= tick and ticks < MAX_TICKS:
+                update()
+                lag -= tick
+                ticks += 1
+
+            if lag >= tick:
+                lag = 0
+
+            self.alpha = lag / tick
+            self.camera.interpolate(self.alpha)
+            draw()
+            self.render()
+
+    def level_path(self, map_id):
+        # Binary maps are preferred over JSON maps with the same id.
+        for ext in (MAP_EXT, '.json'):
+            path = f'data/maps/{map_id}{ext}'
+
+            if os.path.exists(path):
+                return path
+
+        raise FileNotFoundError
+
     def load_level(self, map_id):
-        try:
-            self.tilemap.load(f'data/maps/{map_id}.json')
-        except FileNotFoundError:
-            raise FileNotFoundError
+        self.tilemap.load(self.level_path(map_id))
+
+    def prefetch_level(self, map_id):
+        # Starts decoding the tiles of a level before it is loaded. Finding
+        # its tile types means reading the map, so that is left to the worker.
+        path = self.level_path(map_id)
+        self.assets.prefetch_lookup(lambda: map_types(path))
+
+    def set_background(self, img):
+        # A background that covers the whole display without showing through
+        # replaces the fill of the background display. Pixels matching a black
+        # colorkey would only show the black fill, so the key is dropped.
+        self.background = img
+        self.background_opaque = (img.get_width() >= self.back_d.get_width()
+                                   and img.get_height() >= self.back_d.get_height()
+                                   and not img.get_flags() & pygame.SRCALPHA
+                                   and img.get_alpha() in (None, 255)
+                                   and img.get_colorkey() in (None, (0, 0, 0, 255)))
+
+        if self.background_opaque and img.get_colorkey():
+            self.background = img.copy()
+            self.background.set_colorkey(None)
+
+    def toggle_outline(self):
+        self.outline_cached = not self.outline_cached
+        self.outline_rects = []
+        self.invalidate()
+
+    def toggle_stats(self):
+        self.stats = not self.stats
+        pygame.display.set_caption(self.title)
+
+    def invalidate(self, rect=None):
+        # Marks an area of the display, or all of it, to be redrawn. Rects
+        # are grown to cover the outline around them and rounding.
+        if not self.dirty_mode:
+            return
+
+        if rect is None:
+            self.dirty_full = True
+        else:
+            self.dirty_rects.append(pygame.Rect(rect).inflate(4, 4))
+
+    def is_dirty(self):
+        return not self.dirty_mode or self.dirty_full or bool(self.dirty_rects)
+
+    def is_partial(self):
+        return self.dirty_mode and not self.dirty_full and not self.camera.shake
+
+    def draw(self, img, pos, layer, y=0):
+        # Blits truncate positions, so the outline has to be placed the same
+        # way to line up.
+        pos = (int(pos[0]), int(pos[1]))
+        self.queue.push(layer, self.fore_d, img, pos, y)
+
+        if self.outline_cached:
+            self.queue.push(layer, self.back_d, self.assets.get_outline(img), (pos[0] - 1, pos[1] - 1), y, outline=True)
+
+    def draw_batch(self, blits, outline_blits, layer):
+        # Many images at once, positions are expected to be whole already.
+        self.queue.push_batch(layer, self.fore_d, blits)
+
+        if self.outline_cached:
+            self.queue.push_batch(layer, self.back_d, outline_blits, outline=True)
+
+    def draw_uncached(self, img, pos, layer):
+        # For images that are not kept around, such as translucent copies.
+        self.queue.push(layer, self.fore_d, img, pos)
+        self.mark_outline(pygame.Rect(int(pos[0]), int(pos[1]), *img.get_size()))
+
+    def draw_polygon(self, color, points, layer):
+        self.queue.push_polygon(layer, self.fore_d, color, points)
+
+    def flush(self):
+        # Submits the queued draws, polygons are outlined at the end of the
+        # frame.
+        for rect in self.queue.submit():
+            self.mark_outline(rect)
+
+    def mark_outline(self, rect):
+        # Marks an area of the foreground that was drawn without a cached
+        # outline.
+        if self.outline_cached:
+            self.outline_rects.append(rect)
 
     def clear(self):
+        # Drawing is limited to the changed areas, the rest of the display
+        # still holds the previous frame.
+        if self.is_partial() and self.dirty_rects:
+            clip = self.dirty_rects[0].unionall(self.dirty_rects[1:])
+            self.fore_d.set_clip(clip)
+            self.back_d.set_clip(clip)
+
         self.fore_d.fill((0, 0, 0, 0))
-        self.back_d.fill((0, 0, 0))
+
+        if not self.background_opaque:
+            self.back_d.fill((0, 0, 0))
+
+        if self.background:
+            self.back_d.blit(self.background, (0, 0))
 
     def render(self):
-        display_mask = pygame.mask.from_surface(self.fore_d)
-        display_silhouette = display_mask.to_surface(setcolor=(0, 0, 0, 180), unsetcolor=(0, 0, 0, 0))
+        if not self.is_dirty():
+            # The screen still shows the last frame.
+            self.clock.tick(IDLE_FPS)
+            return
 
-        # Creates the outline by offsetting the silhouette.
-        for offset in SILHOUETTE_OFFSETS:
-            self.back_d.blit(display_silhouette, offset)
+        self.flush()
+
+        if self.outline_cached:
+            self.render_outline_rects()
+        else:
+            self.render_outline(self.fore_d.get_rect())
 
         # Apply the foreground display to the background before rendering the
         # background.
         self.back_d.blit(self.fore_d, (0, 0))
-        self.screen.blit(pygame.transform.scale(self.back_d, self.screen.get_size()), self.get_offset())
-        pygame.display.update()
+
+        if self.is_partial():
+            self.fore_d.set_clip(None)
+            self.back_d.set_clip(None)
+            self.presenter.present_rects(self.back_d, self.dirty_rects)
+        else:
+            self.presenter.present(self.back_d, self.camera.get_offset())
+
+        self.dirty_full = False
+        self.dirty_rects = []
+
+        if self.stats:
+            counts = ' '.join(f'{layer.name.lower()}:{count}' for layer, count in self.queue.counts.items())
+            outlines = ' '.join(f'{layer.name.lower()}:{count}' for layer, count in self.queue.outline_counts.items()
+                                if count)
+            pygame.display.set_caption(f'{self.title} draws {counts} outlines {outlines or "-"} '
+                                       f'present:{self.presenter.present_ms:.2f}ms')
 
         # This method should be called once per frame. It will compute how many
         # milliseconds have passed since the previous call. Passing the
         # optional framerate argument will keep the game running at a maximum
         # of that frame rate.
-        self.clock.tick(60)
+        self.clock.tick(self.max_fps)
+
+    def render_outline(self, rect):
+        display_mask = pygame.mask.from_surface(self.fore_d.subsurface(rect))
+        display_silhouette = display_mask.to_surface(setcolor=(0, 0, 0, 180), unsetcolor=(0, 0, 0, 0))
+
+        # Creates the outline by offsetting the silhouette.
+        for offset in SILHOUETTE_OFFSETS:
+            self.back_d.blit(display_silhouette, (rect.x + offset[0], rect.y + offset[1]))
+
+    def render_outline_rects(self):
+        # Overlapping areas are merged, so that nothing is outlined twice.
+        merged = []
+
+        for rect in self.outline_rects:
+            rect = rect.clip(self.fore_d.get_rect())
+            index = rect.collidelist(merged)
+
+            while index != -1:
+                rect = rect.union(merged.pop(index))
+                index = rect.collidelist(merged)
+
+            if rect:
+                merged.append(rect)
 
-    def get_offset(self):
-        # Normalize screenshake.
-        self.shake = max(0, self.shake - 1)
+        for rect in merged:
+            self.render_outline(rect)
 
-        return (random.random() * self.shake - self.shake / 2,
-                random.random() * self.shake - self.shake / 2)
+        self.outline_rects = []
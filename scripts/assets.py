@@ -1,6 +1,14 @@
+import atexit
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 
-from scripts.utils import Anim, load_image, load_images
+import pygame
+
+from scripts.image_cache import ImageCache
+from scripts.utils import AnimData, decode_image, flip_image, image_paths, load_image, load_images, make_outline
+
+# Width and height of an atlas page.
+ATLAS_SIZE = 512
 
 
 class AssetAnim(Enum):
@@ -15,6 +23,20 @@ class AssetAnim(Enum):
     PLAYER_Y_SLIDE = 'entities/player/y_slide'
 
 
+# Frame duration and looping of every animation.
+ANIMS = {
+    AssetAnim.ENEMY_IDLE: (6, True),
+    AssetAnim.ENEMY_RUN: (4, True),
+    AssetAnim.PARTICLE_LEAF: (20, False),
+    AssetAnim.PARTICLE_DARK: (20, False),
+    AssetAnim.PLAYER_IDLE: (6, True),
+    AssetAnim.PLAYER_JUMP: (5, True),
+    AssetAnim.PLAYER_RUN: (4, True),
+    AssetAnim.PLAYER_SLIDE: (5, True),
+    AssetAnim.PLAYER_Y_SLIDE: (5, True)
+}
+
+
 class AssetLayer(Enum):
     BACKGROUND = 'layers/backgrounds'
     CLOUD = 'layers/clouds'
@@ -33,39 +55,136 @@ class AssetTile(Enum):
     STONE = 'tiles/stone'
 
 
+class Atlas:
+    def __init__(self, size=ATLAS_SIZE):
+        self.size = size
+        self.pages = []
+        # Images are placed left to right along shelves, the next shelf
+        # starts below the tallest image of the current one.
+        self.x = 0
+        self.y = 0
+        self.shelf = 0
+
+    def add_page(self):
+        page = pygame.Surface((self.size, self.size)).convert()
+        # Subsurfaces share the colorkey of the page.
+        page.set_colorkey((0, 0, 0))
+        self.pages.append(page)
+        self.x = 0
+        self.y = 0
+        self.shelf = 0
+
+    def place(self, img):
+        width, height = img.get_size()
+
+        # Images that do not fit a page are kept on their own.
+        if width > self.size or height > self.size:
+            return img
+
+        if not self.pages:
+            self.add_page()
+
+        if self.x + width > self.size:
+            self.x = 0
+            self.y += self.shelf
+            self.shelf = 0
+
+        if self.y + height > self.size:
+            self.add_page()
+
+        page = self.pages[-1]
+        page.blit(img, (self.x, self.y))
+        img = page.subsurface((self.x, self.y, width, height))
+        self.x += width
+        self.shelf = max(self.shelf, height)
+
+        return img
+
+    def pack(self, images):
+        return tuple(self.place(img) for img in images)
+
+
 class Assets:
     def __init__(self):
-        self.anims = {
-            AssetAnim.ENEMY_IDLE.value: Anim(load_images(AssetAnim.ENEMY_IDLE.value), img_dur=6),
-            AssetAnim.ENEMY_RUN.value: Anim(load_images(AssetAnim.ENEMY_RUN.value), img_dur=4),
-            AssetAnim.PARTICLE_LEAF.value: Anim(load_images(AssetAnim.PARTICLE_LEAF.value), img_dur=20, loop=False),
-            AssetAnim.PARTICLE_DARK.value: Anim(load_images(AssetAnim.PARTICLE_DARK.value), img_dur=20, loop=False),
-            AssetAnim.PLAYER_IDLE.value: Anim(load_images(AssetAnim.PLAYER_IDLE.value), img_dur=6),
-            AssetAnim.PLAYER_JUMP.value: Anim(load_images(AssetAnim.PLAYER_JUMP.value)),
-            AssetAnim.PLAYER_RUN.value: Anim(load_images(AssetAnim.PLAYER_RUN.value), img_dur=4),
-            AssetAnim.PLAYER_SLIDE.value: Anim(load_images(AssetAnim.PLAYER_SLIDE.value)),
-            AssetAnim.PLAYER_Y_SLIDE.value: Anim(load_images(AssetAnim.PLAYER_Y_SLIDE.value))
-        }
-        self.layers = {
-            AssetLayer.BACKGROUND.value: load_images(AssetLayer.BACKGROUND.value),
-            AssetLayer.CLOUD.value: load_images(AssetLayer.CLOUD.value)
-        }
-        self.sprites = {
-            AssetSprite.GUN.value: load_image(AssetSprite.GUN.value),
-            AssetSprite.PROJECTILE.value: load_image(AssetSprite.PROJECTILE.value)
-        }
-        self.tiles = {
-            AssetTile.DECOR.value: load_images(AssetTile.DECOR.value),
-            AssetTile.GRASS.value: load_images(AssetTile.GRASS.value),
-            AssetTile.LARGE_DECOR.value: load_images(AssetTile.LARGE_DECOR.value),
-            AssetTile.SPAWNERS.value: load_images(AssetTile.SPAWNERS.value),
-            AssetTile.STONE.value: load_images(AssetTile.STONE.value)
-        }
+        # Decoded pixels of the images, kept between launches.
+        self.cache = ImageCache()
+        # Images that were decoded are written back once the game exits.
+        atexit.register(self.cache.save)
+        # Tiles, animation frames and sprites are subsurfaces of a few shared
+        # pages rather than surfaces of their own.
+        self.atlas = Atlas()
+        # Every asset is loaded the first time it is asked for, or decoded
+        # ahead of time by prefetch().
+        self.anims = {}
+        self.layers = {}
+        self.sprites = {}
+        # Mirrored sprites, animations carry their own.
+        self.flipped_sprites = {}
+        self.tiles = {}
+        # Prefetched assets, mapped onto the decoding that is under way.
+        self.pending = {}
+        # Prefetches whose types are only known once the worker looks them
+        # up, see prefetch_lookup().
+        self.lookups = []
+        self.worker = ThreadPoolExecutor(max_workers=1)
+        # Outlines are built the first time an image is drawn, keyed by the
+        # image.
+        self.outlines = {}
+
+    def prefetch(self, types):
+        # Decodes the images of the given assets, or reads their pixels out
+        # of the image cache, on a worker thread so that their first use only
+        # has to convert them. Converting stays on the main
+        # thread, together with everything else that touches the display.
+        for type in types:
+            if type not in self.pending and not self.is_loaded(type):
+                self.pending[type] = self.worker.submit(self.decode, type)
+
+    def prefetch_lookup(self, lookup):
+        # Like prefetch(), but the types are found by calling lookup on the
+        # worker as well, for when that means reading a file.
+        self.lookups.append(self.worker.submit(self.decode_lookup, lookup))
+
+    def decode(self, type):
+        for path in image_paths(type.value):
+            decode_image(path, self.cache)
+
+    def decode_lookup(self, lookup):
+        for type in lookup():
+            if type not in self.pending and not self.is_loaded(type):
+                self.decode(type)
+
+    def is_loaded(self, type):
+        return any(type.value in loaded for loaded in (self.anims, self.layers, self.sprites, self.tiles))
+
+    def wait(self, type):
+        # Prefetched assets are used once decoded, rather than decoded twice.
+        if type in self.pending:
+            self.pending.pop(type).result()
+
+        # Any lookup may hold the type as well.
+        while self.lookups:
+            self.lookups.pop(0).result()
+
+    def load_anim(self, type: AssetAnim):
+        self.wait(type)
+        img_dur, loop = ANIMS[type]
+        images = load_images(type.value, self.cache)
+        flipped = tuple(flip_image(img) for img in images)
+
+        return AnimData(self.atlas.pack(images), img_dur, loop, self.atlas.pack(flipped))
 
     def get_anim(self, type: AssetAnim):
+        if type.value not in self.anims:
+            self.anims[type.value] = self.load_anim(type)
+
         return self.anims[type.value]
 
     def get_layers(self, type: AssetLayer, var=-1):
+        if type.value not in self.layers:
+            self.wait(type)
+            self.layers[type.value] = load_images(type.value, self.cache)
+
         if (var < 0):
             return self.layers[type.value]
         elif var >= 0 and isinstance(self.layers[type.value], tuple):
@@ -73,16 +192,35 @@ class Assets:
 
         raise FileNotFoundError()
 
-    def get_sprite(self, type: AssetSprite):
+    def get_sprite(self, type: AssetSprite, flip=False):
+        if type.value not in self.sprites:
+            self.wait(type)
+            img = load_image(type.value, self.cache)
+            self.sprites[type.value] = self.atlas.place(img)
+            self.flipped_sprites[type.value] = self.atlas.place(flip_image(img))
+
         if self.sprites[type.value] is None:
             raise FileNotFoundError()
 
+        if flip:
+            return self.flipped_sprites[type.value]
+
         return self.sprites[type.value]
 
     def get_tiles(self, type: AssetTile, var=-1):
+        if type.value not in self.tiles:
+            self.wait(type)
+            self.tiles[type.value] = self.atlas.pack(load_images(type.value, self.cache))
+
         if var < 0:
             return self.tiles[type.value]
         elif var >= 0 and isinstance(self.tiles[type.value], tuple):
             return self.tiles[type.value][var]
 
         raise FileNotFoundError()
+
+    def get_outline(self, img):
+        if img not in self.outlines:
+            self.outlines[img] = make_outline(img)
+
+        return self.outlines[img]
@@ -0,0 +1,147 @@
+import numpy as np
+
+from scripts.assets import AssetTile
+from scripts.chunk import CHUNK_MASK, CHUNK_SIZE, TILE_TYPES, cell_index, chunk_key
+
+# Every cell keeps a 4-bit mask of which neighbours share its type.
+RIGHT = 1
+LEFT = 2
+UP = 4
+DOWN = 8
+AUTOTILE_NEIGHBORS = (
+    (1, 0, RIGHT),
+    (-1, 0, LEFT),
+    (0, -1, UP),
+    (0, 1, DOWN))
+AUTOTILE_TYPES = {
+    AssetTile.GRASS,
+    AssetTile.STONE
+}
+AUTOTILE_MAP = {
+    RIGHT | DOWN: 0,
+    RIGHT | DOWN | LEFT: 1,
+    LEFT | DOWN: 2,
+    LEFT | UP | DOWN: 3,
+    LEFT | UP: 4,
+    LEFT | UP | RIGHT: 5,
+    RIGHT | UP: 6,
+    RIGHT | UP | DOWN: 7,
+    RIGHT | LEFT | DOWN | UP: 8,
+}
+# Lookup tables indexed by mask and by type code, a variant of 255 means
+# the mask has no matching variant and the cell is left alone.
+AUTOTILE_VARS = bytes(AUTOTILE_MAP.get(mask, 255) for mask in range(16))
+AUTOTILE_CODES = bytes(type in AUTOTILE_TYPES for type in TILE_TYPES).ljust(256, b'\0')
+# The same tables as arrays, for passes over whole chunks.
+VARS_TABLE = np.frombuffer(AUTOTILE_VARS, dtype=np.uint8)
+CODES_TABLE = np.frombuffer(AUTOTILE_CODES, dtype=np.uint8).astype(bool)
+
+
+class Autotiler:
+    def __init__(self, tilemap):
+        self.tilemap = tilemap
+        # Applies variants to the cells around every edit.
+        self.live = False
+
+    def grid(self, key):
+        # The type codes of a chunk as rows and columns, or None if there is
+        # no such chunk.
+        chunk = self.tilemap.get_chunk(key)
+
+        if chunk is None:
+            return None
+
+        return np.frombuffer(chunk.types, dtype=np.uint8).reshape(CHUNK_SIZE, CHUNK_SIZE)
+
+    def mask_chunk(self, chunk):
+        cx, cy = chunk.pos
+        types = self.grid(chunk.pos)
+
+        # The chunk is framed by the edges of its neighbours, so that every
+        # mask bit becomes a comparison with the frame shifted by one cell.
+        framed = np.zeros((CHUNK_SIZE + 2, CHUNK_SIZE + 2), dtype=np.uint8)
+        framed[1:-1, 1:-1] = types
+
+        for key, edge, cells in (((cx - 1, cy), (slice(1, -1), 0), (slice(None), CHUNK_MASK)),
+                                 ((cx + 1, cy), (slice(1, -1), -1), (slice(None), 0)),
+                                 ((cx, cy - 1), (0, slice(1, -1)), (CHUNK_MASK, slice(None))),
+                                 ((cx, cy + 1), (-1, slice(1, -1)), (0, slice(None)))):
+            neighbour = self.grid(key)
+
+            if neighbour is not None:
+                framed[edge] = neighbour[cells]
+
+        masks = ((types == framed[1:-1, 2:]) * RIGHT
+                 | (types == framed[1:-1, :-2]) * LEFT
+                 | (types == framed[:-2, 1:-1]) * UP
+                 | (types == framed[2:, 1:-1]) * DOWN)
+        masks[types == 0] = 0
+        chunk.masks = bytearray(masks.astype(np.uint8).tobytes())
+
+    def mask_cell(self, chunk, x, y):
+        index = cell_index(x, y)
+        code = chunk.types[index]
+        mask = 0
+
+        if code:
+            for dx, dy, bit in AUTOTILE_NEIGHBORS:
+                if self.tilemap.get_code(x + dx, y + dy) == code:
+                    mask |= bit
+
+        chunk.masks[index] = mask
+
+    def apply_cell(self, chunk, x, y):
+        index = cell_index(x, y)
+        var = AUTOTILE_VARS[chunk.masks[index]]
+
+        if AUTOTILE_CODES[chunk.types[index]] and var != 255 and chunk.vars[index] != var:
+            self.tilemap.set_var(chunk, x, y, var)
+
+    def apply_chunk(self, chunk):
+        types = np.frombuffer(chunk.types, dtype=np.uint8)
+        autotiled = CODES_TABLE[types]
+
+        # Chunks without any autotiled cells are left alone, which also
+        # spares reindexing them.
+        if not autotiled.any():
+            return
+
+        new_vars = VARS_TABLE[np.frombuffer(chunk.masks, dtype=np.uint8)]
+        self.tilemap.unindex_chunk(chunk)
+        chunk.vars = bytearray(np.where(autotiled & (new_vars != 255), new_vars,
+                                        np.frombuffer(chunk.vars, dtype=np.uint8)).tobytes())
+        self.tilemap.index_chunk(chunk)
+
+    def dirty(self, x, y):
+        # An edit changes the masks of the cell and its four neighbours, and
+        # nothing else.
+        for dx, dy, _ in ((0, 0, 0),) + AUTOTILE_NEIGHBORS:
+            chunk = self.tilemap.chunks.get(chunk_key(x + dx, y + dy))
+
+            if chunk is None:
+                continue
+
+            if chunk.masks is None:
+                # Masks are only kept up to date once something needs them.
+                if not self.live:
+                    continue
+
+                self.mask_chunk(chunk)
+            else:
+                self.mask_cell(chunk, x + dx, y + dy)
+
+            if self.live:
+                self.apply_cell(chunk, x + dx, y + dy)
+
+    def automap(self):
+        tilemap = self.tilemap
+        tilemap.load_all()
+
+        for chunk in tilemap.chunks.values():
+            self.mask_chunk(chunk)
+
+        for chunk in tilemap.chunks.values():
+            self.apply_chunk(chunk)
+
+        tilemap.modified.update(tilemap.chunks)
+        tilemap.cache.invalidate_all()
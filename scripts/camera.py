@@ -0,0 +1,57 @@
+import random
+
+import pygame
+
+from scripts.utils import Vec2
+
+
+class Camera:
+    def __init__(self, size):
+        self.size = size
+        self.scroll = Vec2((0, 0))
+        # The scroll of the previous tick, see interpolate().
+        self.last_scroll = Vec2((0, 0))
+        # The scroll snapped to whole pixels, everything is drawn offset by it.
+        self.render_scroll = Vec2((0, 0))
+        # The part of the world shown on the display, in world pixels.
+        self.viewport = pygame.Rect((0, 0), size)
+        self.shake = 0
+
+    def update(self):
+        # Screenshake wears off by one every tick.
+        self.shake = max(0, self.shake - 1)
+
+    def move(self, scroll):
+        # Jumps straight to scroll, without easing or interpolation.
+        self.last_scroll = scroll
+        self.scroll = scroll
+        self.interpolate(1)
+
+    def follow(self, pos, smoothing=30):
+        # Eases the center of the display towards pos, by one tick.
+        self.last_scroll = self.scroll
+        self.scroll = self.scroll.add(((pos[0] - self.size[0] / 2 - self.scroll.x) / smoothing,
+                                       (pos[1] - self.size[1] / 2 - self.scroll.y) / smoothing))
+        self.interpolate(1)
+
+    def interpolate(self, alpha):
+        # Places the display between the scroll of the last two ticks, alpha
+        # being how far the frame is into the current tick.
+        self.render_scroll = self.scroll.sub(self.scroll.sub(self.last_scroll).mult(1 - alpha)).int()
+        self.viewport.topleft = self.render_scroll.tuple()
+
+    def bounds(self, margin=0):
+        # The viewport grown by margin, as left, top, right and bottom.
+        return (self.viewport.left - margin, self.viewport.top - margin,
+                self.viewport.right + margin, self.viewport.bottom + margin)
+
+    def visible(self, rect, margin=0):
+        # Whether rect, in world pixels, overlaps the viewport grown by margin.
+        # Margins cover what is drawn outside of the rect, e.g. outlines.
+        left, top, right, bottom = self.bounds(margin)
+
+        return rect[0] + rect[2] > left and rect[0] < right and rect[1] + rect[3] > top and rect[1] < bottom
+
+    def get_offset(self):
+        return (random.random() * self.shake - self.shake / 2,
+                random.random() * self.shake - self.shake / 2)
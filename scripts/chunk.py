@@ -0,0 +1,121 @@
+from scripts.assets import AssetTile
+
+# Chunks are square and a power of two wide so that cell coordinates can be
+# split into chunk and local coordinates with shifts and masks, which also
+# floor correctly for negative coordinates.
+CHUNK_SHIFT = 4
+CHUNK_SIZE = 1 << CHUNK_SHIFT
+CHUNK_MASK = CHUNK_SIZE - 1
+CHUNK_AREA = CHUNK_SIZE * CHUNK_SIZE
+# Bytes held by the cell arrays of one chunk.
+CHUNK_BYTES = CHUNK_AREA * 3
+
+# Cells store their type as a small integer code, zero marks an empty cell.
+TILE_TYPES = (None,) + tuple(AssetTile)
+TILE_CODES = {type: code for code, type in enumerate(TILE_TYPES) if type}
+
+PHYSICS_TILES = {
+    AssetTile.GRASS,
+    AssetTile.STONE
+}
+# Maps a type code onto the solidity of the cell, for use with translate().
+SOLID_TABLE = bytes(type in PHYSICS_TILES for type in TILE_TYPES).ljust(256, b'\0')
+
+
+def chunk_key(x, y):
+    return (x >> CHUNK_SHIFT, y >> CHUNK_SHIFT)
+
+
+def cell_index(x, y):
+    return ((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)
+
+
+class Chunk:
+    def __init__(self, pos):
+        # Chunk coordinates, i.e. cell coordinates shifted by CHUNK_SHIFT.
+        self.pos = pos
+        # Cells are laid out row by row.
+        self.types = bytearray(CHUNK_AREA)
+        self.vars = bytearray(CHUNK_AREA)
+        # One byte per cell, set for cells that entities collide with.
+        self.solid = bytearray(CHUNK_AREA)
+        # Autotile neighbour masks, only built once something needs them.
+        self.masks = None
+        # Merged collision rects in cell units, rebuilt after solidity
+        # changes.
+        self.rects = None
+        self.count = 0
+
+    def set(self, index, type, var):
+        if not self.types[index]:
+            self.count += 1
+
+        self.types[index] = TILE_CODES[type]
+        self.vars[index] = var
+
+        if self.solid[index] != SOLID_TABLE[self.types[index]]:
+            self.solid[index] = SOLID_TABLE[self.types[index]]
+            self.rects = None
+
+    def remove(self, index):
+        if self.types[index]:
+            self.count -= 1
+            self.types[index] = 0
+            self.vars[index] = 0
+
+            if self.solid[index]:
+                self.solid[index] = 0
+                self.rects = None
+
+            if self.masks is not None:
+                self.masks[index] = 0
+
+    def cells(self):
+        # Yields the cell coordinates, type and variant of every tile.
+        base_x = self.pos[0] << CHUNK_SHIFT
+        base_y = self.pos[1] << CHUNK_SHIFT
+        types = self.types
+        vars = self.vars
+
+        for index in range(CHUNK_AREA):
+            if types[index]:
+                yield (base_x + (index & CHUNK_MASK), base_y + (index >> CHUNK_SHIFT), TILE_TYPES[types[index]], vars[index])
+
+    def solid_rects(self):
+        # Greedy meshing, each run of solid cells is grown to the right and
+        # then downwards for as long as the whole run stays solid.
+        if self.rects is None:
+            solid = self.solid
+            used = bytearray(CHUNK_AREA)
+            rects = []
+
+            for index in range(CHUNK_AREA):
+                if not solid[index] or used[index]:
+                    continue
+
+                x = index & CHUNK_MASK
+                y = index >> CHUNK_SHIFT
+                width = 1
+
+                while x + width < CHUNK_SIZE and solid[index + width] and not used[index + width]:
+                    width += 1
+
+                height = 1
+
+                while y + height < CHUNK_SIZE:
+                    row = index + (height << CHUNK_SHIFT)
+
+                    if not all(solid[row:row + width]) or any(used[row:row + width]):
+                        break
+
+                    height += 1
+
+                for row in range(height):
+                    start = index + (row << CHUNK_SHIFT)
+                    used[start:start + width] = b'\1' * width
+
+                rects.append((x, y, width, height))
+
+            self.rects = tuple(rects)
+
+        return self.rects
@@ -0,0 +1,140 @@
+import pygame
+
+from scripts.chunk import CHUNK_SHIFT, CHUNK_SIZE, TILE_TYPES
+from scripts.render_queue import Layer
+from scripts.utils import make_outline
+
+
+class ChunkCache:
+    def __init__(self, tilemap):
+        self.tilemap = tilemap
+        # Baked surfaces keyed by chunk coordinates, None marks a chunk that
+        # has nothing to render.
+        self.surfs = {}
+        # Outlines of the baked surfaces, built the first time they are
+        # needed.
+        self.outlines = {}
+        # The largest tile image of the types in the map, see add_types().
+        self.extent = (0, 0)
+        self.sized = set()
+
+    def chunk_px(self):
+        return CHUNK_SIZE * self.tilemap.size
+
+    def add_types(self, types):
+        # The largest tile image decides how far a tile may reach into the
+        # neighbouring chunks. Only the types in the map count, so that the
+        # tiles of other types are not loaded for it.
+        width, height = self.extent
+
+        for type in types:
+            if type not in self.sized:
+                self.sized.add(type)
+
+                for img in self.tilemap.game.assets.get_tiles(type):
+                    width = max(width, img.get_width())
+                    height = max(height, img.get_height())
+
+        self.extent = (width, height)
+
+    def tile_extent(self):
+        return self.extent
+
+    def baked_bytes(self, key):
+        size = 0
+
+        for surfs in (self.surfs, self.outlines):
+            if surfs.get(key) is not None:
+                size += surfs[key].get_width() * surfs[key].get_height() * 4
+
+        return size
+
+    def invalidate(self, key):
+        self.surfs.pop(key, None)
+        self.outlines.pop(key, None)
+
+    def invalidate_rect(self, left, top, width, height):
+        chunk_px = self.chunk_px()
+
+        for cx in range(int(left // chunk_px), int((left + width - 1) // chunk_px) + 1):
+            for cy in range(int(top // chunk_px), int((top + height - 1) // chunk_px) + 1):
+                self.invalidate((cx, cy))
+
+        # The same area has to be redrawn on screen.
+        scroll = self.tilemap.game.camera.render_scroll
+        self.tilemap.game.invalidate((left - scroll[0], top - scroll[1], width, height))
+
+    def invalidate_cell(self, x, y):
+        self.invalidate_rect(x * self.tilemap.size, y * self.tilemap.size, *self.tile_extent())
+
+    def invalidate_all(self):
+        self.surfs = {}
+        self.outlines = {}
+        self.tilemap.game.invalidate()
+
+    def reset(self):
+        # Forgets the types of the previous map as well.
+        self.invalidate_all()
+        self.extent = (0, 0)
+        self.sized = set()
+
+    def bake(self, key):
+        tilemap = self.tilemap
+        size = tilemap.size
+        get_tiles = tilemap.game.assets.get_tiles
+        chunk_px = self.chunk_px()
+        origin_x = key[0] * chunk_px
+        origin_y = key[1] * chunk_px
+        chunk_r = pygame.Rect(origin_x, origin_y, chunk_px, chunk_px)
+        blits = []
+
+        # Offgrid tiles are often rendered as decorations, therefor we should
+        # render them first so that they are applied behind the grid.
+        for tile in tilemap.offgrid_in_rect(chunk_r):
+            blits.append((get_tiles(tile.type, tile.var), (tile.pos.x - origin_x, tile.pos.y - origin_y)))
+
+        # Tiles larger than a cell may reach in from the chunks to the left
+        # and above, so those cells are included as well.
+        extent_w, extent_h = self.tile_extent()
+        left = key[0] << CHUNK_SHIFT
+        top = key[1] << CHUNK_SHIFT
+
+        for x, y, code, var in tilemap.cells_in(left - (extent_w - 1) // size, top - (extent_h - 1) // size,
+                                                left + CHUNK_SIZE - 1, top + CHUNK_SIZE - 1):
+            blits.append((get_tiles(TILE_TYPES[code], var), (x * size - origin_x, y * size - origin_y)))
+
+        if not blits:
+            return None
+
+        surf = pygame.Surface((chunk_px, chunk_px), pygame.SRCALPHA)
+
+        for img, pos in blits:
+            surf.blit(img, pos)
+
+        return surf
+
+    def render(self, surf, offset=(0, 0), outline_surf=None):
+        chunk_px = self.chunk_px()
+        scroll_x, scroll_y = offset
+        queue = self.tilemap.game.queue
+        # Only the chunks that intersect the camera are drawn.
+        for cx in range(scroll_x // chunk_px, (scroll_x + surf.get_width() - 1) // chunk_px + 1):
+            for cy in range(scroll_y // chunk_px, (scroll_y + surf.get_height() - 1) // chunk_px + 1):
+                key = (cx, cy)
+
+                if key not in self.surfs:
+                    self.surfs[key] = self.bake(key)
+
+                chunk_surf = self.surfs[key]
+
+                if chunk_surf is None:
+                    continue
+
+                pos = (cx * chunk_px - scroll_x, cy * chunk_px - scroll_y)
+                queue.push(Layer.TILEMAP, surf, chunk_surf, pos)
+
+                if outline_surf is not None:
+                    if key not in self.outlines:
+                        self.outlines[key] = make_outline(chunk_surf)
+
+                    queue.push(Layer.TILEMAP, outline_surf, self.outlines[key], (pos[0] - 1, pos[1] - 1), outline=True)
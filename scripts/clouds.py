@@ -1,7 +1,14 @@
 import random
 
+import pygame
+
+from scripts.render_queue import Layer
 from scripts.utils import Vec2
 
+# Clouds are grouped by depth into this many bands, every band is drawn with
+# a single blit however many clouds it holds.
+CLOUD_BANDS = 3
+
 
 class Cloud:
     def __init__(self, img, pos=Vec2((0, 0)), speed=0, depth=0):
@@ -10,23 +17,41 @@ class Cloud:
         self.speed = speed
         self.depth = depth
 
+
+class CloudBand:
+    def __init__(self, clouds, size):
+        # Clouds of a band move together at its average depth and speed.
+        self.depth = sum(cloud.depth for cloud in clouds) / len(clouds)
+        self.speed = sum(cloud.speed for cloud in clouds) / len(clouds)
+        self.drift = 0
+        self.size = size
+        # Clouds wrap around once they are fully off-screen, so the band
+        # repeats every display size grown by its largest cloud.
+        self.period = (size[0] + max(cloud.img.get_width() for cloud in clouds),
+                       size[1] + max(cloud.img.get_height() for cloud in clouds))
+        # The band is drawn two periods wide and high, so that any area the
+        # size of the display fits inside it without wrapping.
+        self.surf = pygame.Surface((self.period[0] * 2, self.period[1] * 2)).convert()
+        self.surf.set_colorkey((0, 0, 0))
+
+        for cloud in clouds:
+            for x in range(-1, 2):
+                for y in range(-1, 2):
+                    self.surf.blit(cloud.img, (cloud.pos.x % self.period[0] + x * self.period[0],
+                                               cloud.pos.y % self.period[1] + y * self.period[1]))
+
     def update(self):
-        self.pos.x += self.speed
+        self.drift += self.speed
 
-    def render(self, surf, offset=Vec2((0, 0))):
+    def render(self, queue, surf, offset=Vec2((0, 0))):
         # Multiplying depth with offset will give a parallax effect.
-        render_pos = self.pos.sub(offset.mult(self.depth))
-
-        # Mod the image's dimensions (not removed before it is off-screen).
-        # Subtract the image's dimensions (add clouds off-screen)
-        surf.blit(self.img, render_pos
-                  .mod((surf.get_width() + self.img.get_width(), surf.get_height() + self.img.get_height()))
-                  .sub((self.img.get_width(), self.img.get_height()))
-                  .tuple())
+        x = int(offset.x * self.depth - self.drift) % self.period[0]
+        y = int(offset.y * self.depth) % self.period[1]
+        queue.push(Layer.CLOUDS, surf, self.surf.subsurface((x, y), self.size), (0, 0))
 
 
 class Clouds:
-    def __init__(self, cloud_images, count=16):
+    def __init__(self, cloud_images, size, count=16):
         self.clouds = []
 
         for _ in range(count):
@@ -38,11 +63,18 @@ class Clouds:
 
         # This ensures that clouds are rendered in correct order.
         self.clouds.sort(key=lambda cloud: cloud.depth)
+        self.bands = []
+
+        for band in range(CLOUD_BANDS):
+            clouds = self.clouds[band * count // CLOUD_BANDS:(band + 1) * count // CLOUD_BANDS]
+
+            if clouds:
+                self.bands.append(CloudBand(clouds, size))
 
     def update(self):
-        for cloud in self.clouds:
-            cloud.update()
+        for band in self.bands:
+            band.update()
 
-    def render(self, surf, offset=Vec2((0, 0))):
-        for cloud in self.clouds:
-            cloud.render(surf, offset=offset)
+    def render(self, queue, surf, offset=Vec2((0, 0))):
+        for band in self.bands:
+            band.render(queue, surf, offset=offset)
@@ -6,10 +6,15 @@ import pygame
 from scripts.assets import AssetAnim, AssetSprite
 from scripts.hitpoint import Hitpoint
 from scripts.particle import PartFactory, Particle
-from scripts.projectile import Proj
+from scripts.projectile import PROJ_LIFETIME, Proj
+from scripts.render_queue import Layer
 from scripts.sounds import SoundEffect
 from scripts.spark import SparkFactory
-from scripts.utils import Dir, Vec2
+from scripts.utils import Anim, Dir, Vec2
+
+# How far the sprites of an entity reach outside of its rect, guns and
+# outlines included.
+RENDER_MARGIN = 16
 
 
 class PhysicsEntity:
@@ -18,6 +23,8 @@ class PhysicsEntity:
         self.asset = None
         self.size = size
         self.pos = pos.deepcopy()
+        # The position of the previous tick, see render_pos().
+        self.last_pos = pos.deepcopy()
         self.hitpoint = Hitpoint(1)
         self.vel = Vec2((0, 0))
         self.vel_f = self.vel.deepcopy()
@@ -31,9 +38,15 @@ class PhysicsEntity:
     def set_anim(self, asset):
         if asset != self.asset:
             self.asset = asset
-            self.anim = self.game.assets.get_anim(asset).deepcopy()
+            self.anim = Anim(self.game.assets.get_anim(asset))
+
+    def place(self, pos):
+        # Moves without interpolating from the old position.
+        self.pos = pos.deepcopy()
+        self.last_pos = pos.deepcopy()
 
     def update(self, movement=Vec2((0, 0))):
+        self.last_pos = self.pos.deepcopy()
         self.collisions.reset()
         self.update_vel_f(movement)
         self.handle_flip()
@@ -58,32 +71,24 @@ class PhysicsEntity:
             self.anim.update()
 
     def update_pos_x(self):
-        self.pos.x += self.vel_f.x
-        entity_rect = self.rect()
-        for rect in self.game.tilemap.physics_rects_around(self.pos):
-            if entity_rect.colliderect(rect):
-                if self.vel_f.x > 0:
-                    entity_rect.right = rect.left
-                    self.collisions.right = True
-                if self.vel_f.x < 0:
-                    entity_rect.left = rect.right
-                    self.collisions.left = True
-
-                self.pos.x = entity_rect.x
+        target = self.pos.x + self.vel_f.x
+        self.pos.x = self.game.tilemap.sweep_x(self.pos.x, self.pos.y, *self.size, self.vel_f.x)
+
+        if self.pos.x != target:
+            if self.vel_f.x > 0:
+                self.collisions.right = True
+            if self.vel_f.x < 0:
+                self.collisions.left = True
 
     def update_pos_y(self):
-        self.pos.y += self.vel_f.y
-        entity_rect = self.rect()
-        for rect in self.game.tilemap.physics_rects_around(self.pos):
-            if entity_rect.colliderect(rect):
-                if self.vel_f.y > 0:
-                    entity_rect.bottom = rect.top
-                    self.collisions.down = True
-                if self.vel_f.y < 0:
-                    entity_rect.top = rect.bottom
-                    self.collisions.up = True
-
-                self.pos.y = entity_rect.y
+        target = self.pos.y + self.vel_f.y
+        self.pos.y = self.game.tilemap.sweep_y(self.pos.x, self.pos.y, *self.size, self.vel_f.y)
+
+        if self.pos.y != target:
+            if self.vel_f.y > 0:
+                self.collisions.down = True
+            if self.vel_f.y < 0:
+                self.collisions.up = True
 
     def apply_gravity(self):
         # Apply gravity, with a terminal vel.
@@ -102,15 +107,22 @@ class PhysicsEntity:
     def rect(self):
         return pygame.Rect(*self.pos, *self.size)
 
+    def render_pos(self):
+        # Between the positions of the last two ticks, as far as the frame is
+        # into the current tick.
+        return self.pos.sub(self.pos.sub(self.last_pos).mult(1 - self.game.alpha))
+
     def render(self):
-        self.game.fore_d.blit(pygame.transform.flip(self.anim.img(), self.flip, False),
-                              self.pos.sub(self.game.render_scroll).add(self.anim_offset).tuple())
+        self.game.draw(self.anim.img(self.flip), self.render_pos().sub(self.game.camera.render_scroll).add(self.anim_offset).tuple(),
+                       Layer.ENTITIES, self.rect().bottom)
 
 
 class Enemy(PhysicsEntity):
     def __init__(self, game, size, pos):
         super().__init__(game, AssetAnim.ENEMY_IDLE, size, pos)
         self.walking = 0
+        # Whether a wall is in the way of the shot of this tick, see aim().
+        self.blocked = False
 
     def update(self, movement=Vec2((0, 0))):
         if self.walking:
@@ -143,17 +155,40 @@ class Enemy(PhysicsEntity):
             if (abs(diff.y) < 16):
                 self.shoot(diff)
 
+    def aim(self):
+        # The line of sight to check when the enemy shoots this tick, or None.
+        # Shots end a walk, and neither the enemy nor the player has moved
+        # yet, so Game casts these for every enemy at once before updating.
+        if self.walking != 1:
+            return None
+
+        diff = Vec2((self.game.player.pos.x - self.pos.x, self.game.player.pos.y - self.pos.y))
+
+        if abs(diff.y) >= 16 or not diff.x:
+            return None
+
+        pos = (self.rect().centerx + (-7 if diff.x < 0 else 7), self.rect().centery)
+
+        return (pos, (self.game.player.rect().centerx, pos[1]))
+
     def shoot(self, diff=Vec2((0, 0))):
         if self.flip and diff.x < 0:
             pos = Vec2((self.rect().centerx - 7, self.rect().centery))
             vel = Vec2((-1.5, 0))
-            self.game.projs.append(Proj(pos, vel))
-            self.add_shoot_effects()
         elif not self.flip and diff.x > 0:
             pos = Vec2((self.rect().centerx + 7, self.rect().centery))
             vel = Vec2((1.5, 0))
-            self.game.projs.append(Proj(pos, vel))
-            self.add_shoot_effects()
+        else:
+            return
+
+        # Projectiles fly straight, so skip shots that a wall would stop
+        # before they reach the player.
+        if self.blocked:
+            return
+
+        impact = self.game.tilemap.impact_frame(pos, vel, PROJ_LIFETIME)
+        self.game.projs.append(Proj(pos, vel, impact))
+        self.add_shoot_effects()
 
     def add_shoot_effects(self):
         self.game.sounds.get_sfx(SoundEffect.SHOOT).play()
@@ -172,27 +207,26 @@ class Enemy(PhysicsEntity):
 
     def add_hit_effects(self):
         self.game.sounds.get_sfx(SoundEffect.HIT).play()
-        self.game.shake = max(16, self.game.shake)
+        self.game.camera.shake = max(16, self.game.camera.shake)
 
-        for spark in SparkFactory.burst(Vec2(self.rect().center)):
-            self.game.sparks.append(spark)
+        self.game.sparks.extend(SparkFactory.burst(Vec2(self.rect().center)))
 
-        for part in PartFactory.burst(self.game, AssetAnim.PARTICLE_DARK, Vec2(self.rect().center)):
-            self.game.parts.append(part)
+        self.game.parts.extend(PartFactory.burst(self.game, AssetAnim.PARTICLE_DARK, Vec2(self.rect().center)))
 
         self.game.sparks.append(SparkFactory.line(self.pos, 0))
         self.game.sparks.append(SparkFactory.line(self.pos, math.pi))
 
     def render(self):
         super().render()
-        gun_img = self.game.assets.get_sprite(AssetSprite.GUN)
+        gun_img = self.game.assets.get_sprite(AssetSprite.GUN, self.flip)
+        rect = pygame.Rect(*self.render_pos(), *self.size)
 
         if self.flip:
-            pos = (Vec2((self.rect().centerx - 4 - gun_img.get_width(), self.rect().centery)).sub(self.game.render_scroll))
-            self.game.fore_d.blit(pygame.transform.flip(gun_img, True, False), pos.tuple())
+            pos = (Vec2((rect.centerx - 4 - gun_img.get_width(), rect.centery)).sub(self.game.camera.render_scroll))
         else:
-            pos = (Vec2((self.rect().centerx + 4, self.rect().centery)).sub(self.game.render_scroll))
-            self.game.fore_d.blit(gun_img, pos.tuple())
+            pos = (Vec2((rect.centerx + 4, rect.centery)).sub(self.game.camera.render_scroll))
+
+        self.game.draw(gun_img, pos.tuple(), Layer.ENTITIES, self.rect().bottom)
 
 
 class Player(PhysicsEntity):
@@ -241,8 +275,7 @@ class Player(PhysicsEntity):
             self.dashing = max(0, self.dashing - 1)
 
             if self.dashing in self.dashing_thresholds:
-                for part in PartFactory.burst2(self.game, AssetAnim.PARTICLE_DARK, Vec2(self.rect().center)):
-                    self.game.parts.append(part)
+                self.game.parts.extend(PartFactory.burst2(self.game, AssetAnim.PARTICLE_DARK, Vec2(self.rect().center)))
 
         if self.dashing > self.dashing_diff:
             self.vel.x = (-8 if self.flip else 8)
@@ -255,7 +288,7 @@ class Player(PhysicsEntity):
 
     def update_anim(self):
         if not self.y_slide:
-            if self.in_air and self.air_time > self.anim.img_dur:
+            if self.in_air and self.air_time > self.anim.data.img_dur:
                 self.set_anim(AssetAnim.PLAYER_JUMP)
             elif self.dashing > self.dashing_max - self.dashing_dur:
                 self.set_anim(AssetAnim.PLAYER_SLIDE)
@@ -0,0 +1,190 @@
+import mmap
+import os
+import struct
+import threading
+
+import pygame
+
+# The image cache holds the decoded pixels of images, so that launches skip
+# decoding PNGs. It starts with this header:
+#   magic, version, entry count
+# followed by the entries:
+#   path (length prefixed), modification time and size of the source image,
+#   width, height, flags, colorkey and the pixels as RGB.
+# Entries are only used while the modification time and size of their source
+# image match, otherwise the image is decoded again and the cache rewritten.
+CACHE_MAGIC = b'DIMG'
+CACHE_VERSION = 1
+CACHE_PATH = 'data/images.cache'
+HEADER = struct.Struct('<4sHI')
+ENTRY = struct.Struct('<qqHHB3BI')
+
+# Entry flags.
+COLORKEY = 1
+RLE = 2
+
+
+class ImageCache:
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        # Paths map onto modification time, size, width, height, flags,
+        # colorkey and pixels. Pixels of cached images are views into the
+        # memory-mapped cache file, so they stay in the page cache of the OS
+        # rather than in memory of our own.
+        self.entries = {}
+        # Pixels copied out of the cache file ahead of load(), see stage().
+        self.staged = {}
+        self.file = None
+        self.data = None
+        self.stale = False
+        # Images may be decoded on a worker thread while the main thread
+        # loads others, see raw().
+        self.lock = threading.Lock()
+        self.read()
+
+    def read(self):
+        if not os.path.exists(self.path) or not os.path.getsize(self.path):
+            self.stale = True
+            return
+
+        # The file is mapped once, the mapping keeps showing the file as it
+        # was even if another launch replaces it.
+        self.file = open(self.path, 'rb')
+        self.data = memoryview(mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ))
+        data = self.data
+
+        try:
+            magic, version, count = HEADER.unpack_from(data, 0)
+
+            if magic != CACHE_MAGIC or version != CACHE_VERSION:
+                self.stale = True
+                return
+
+            offset = HEADER.size
+
+            for _ in range(count):
+                length = data[offset]
+                path = bytes(data[offset + 1:offset + 1 + length]).decode('utf-8')
+                offset += 1 + length
+                mtime, size, width, height, flags, r, g, b, pixel_bytes = ENTRY.unpack_from(data, offset)
+                offset += ENTRY.size
+                pixels = data[offset:offset + pixel_bytes]
+                offset += pixel_bytes
+
+                if len(pixels) != pixel_bytes or pixel_bytes != width * height * 3:
+                    raise ValueError(f'broken entry for {path}')
+
+                self.entries[path] = (mtime, size, width, height, flags, (r, g, b), pixels)
+        except (IndexError, UnicodeDecodeError, ValueError, struct.error):
+            # A truncated or corrupt cache is dropped, and rebuilt from the
+            # images as they are loaded.
+            self.entries.clear()
+            self.stale = True
+
+    def close(self):
+        # Views into the mapping have to be gone before it can be closed.
+        self.entries.clear()
+        self.staged.clear()
+
+        if self.data is not None:
+            mapping = self.data.obj
+            self.data.release()
+            mapping.close()
+            self.file.close()
+            self.data = None
+            self.file = None
+
+    def decode(self, path, colorkey, rle, stat):
+        img = pygame.image.load(path)
+        flags = (COLORKEY if colorkey else 0) | (RLE if rle else 0)
+        entry = (stat.st_mtime_ns, stat.st_size, img.get_width(), img.get_height(), flags,
+                 colorkey or (0, 0, 0), pygame.image.tobytes(img, 'RGB'))
+
+        with self.lock:
+            self.entries[path] = entry
+            self.stale = True
+
+        return entry
+
+    def raw(self, path, colorkey=None, rle=False):
+        # The entry of the image at path, decoded again if it is stale. Only
+        # touches files and pixel data, so it may run off the main thread.
+        stat = os.stat(path)
+        entry = self.entries.get(path)
+        flags = (COLORKEY if colorkey else 0) | (RLE if rle else 0)
+
+        if (entry is None or entry[0] != stat.st_mtime_ns or entry[1] != stat.st_size or entry[4] != flags
+                or (colorkey and entry[5] != tuple(colorkey))):
+            entry = self.decode(path, colorkey, rle, stat)
+
+        return entry
+
+    def stage(self, path, colorkey=None, rle=False):
+        # Reads the pixels of the image at path out of the cache file, so
+        # that load() does not wait on the disk. Meant for a worker thread.
+        entry = self.raw(path, colorkey, rle)
+        self.staged[path] = (entry, bytes(entry[6]))
+
+    def load(self, path, colorkey=None, rle=False):
+        # The image at path, converted for the display and keyed out as given.
+        entry = self.raw(path, colorkey, rle)
+        staged = self.staged.pop(path, None)
+        # Staged pixels are dropped once converted, and only used while the
+        # entry they were read for is current.
+        _, _, width, height, flags, colorkey, pixels = entry
+
+        if staged and staged[0] is entry:
+            pixels = staged[1]
+
+        img = pygame.image.frombuffer(pixels, (width, height), 'RGB').convert()
+
+        if flags & COLORKEY:
+            img.set_colorkey(colorkey, pygame.RLEACCEL if flags & RLE else 0)
+
+        return img
+
+    def build(self, root, colorkey=None, rle=False):
+        # Decodes every image below root whose entry is missing or stale.
+        for dir, _, names in os.walk(root):
+            for name in names:
+                if not name.endswith('.png'):
+                    continue
+
+                self.raw(os.path.join(dir, name).replace(os.sep, '/'), colorkey, rle)
+
+    def save(self):
+        with self.lock:
+            if not self.stale:
+                return
+
+            self.write()
+            # The mapping has to be closed before its file can be replaced on
+            # some systems. Entries are read back from the new file.
+            self.close()
+
+            try:
+                os.replace(self.path + '.tmp', self.path)
+            except OSError:
+                # E.g. another launch still has the cache open, it is written
+                # by a later launch instead.
+                os.remove(self.path + '.tmp')
+
+            self.stale = False
+            self.read()
+
+    def write(self):
+        # Entries of images that no longer exist are dropped.
+        entries = [(path, entry) for path, entry in self.entries.items() if os.path.exists(path)]
+        parts = [HEADER.pack(CACHE_MAGIC, CACHE_VERSION, len(entries))]
+
+        for path, (mtime, size, width, height, flags, colorkey, pixels) in entries:
+            encoded = path.encode('utf-8')
+            parts.append(bytes([len(encoded)]) + encoded)
+            parts.append(ENTRY.pack(mtime, size, width, height, flags, *colorkey, len(pixels)))
+            parts.append(pixels)
+
+        # Written next to the cache first, so that an interrupted write never
+        # leaves a broken cache behind.
+        f = open(self.path + '.tmp', 'wb')
+        f.write(b''.join(parts))
+        f.close()
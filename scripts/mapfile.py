@@ -0,0 +1,204 @@
+import json
+import mmap
+import struct
+
+from scripts.assets import AssetTile
+from scripts.chunk import CHUNK_AREA, CHUNK_SIZE, SOLID_TABLE, TILE_CODES, TILE_TYPES, Chunk, cell_index, chunk_key
+
+# Binary maps start with this header:
+#   magic, version, tile size, chunk size, type count, chunk count, offgrid count
+# followed by the type table (length prefixed enum names), the chunk directory
+# (chunk x, chunk y, payload offset, bitmask of the type codes present in the
+# chunk), the offgrid records (type, var, x, y)
+# and finally the chunk payloads (cell types followed by cell variants).
+# Type codes in the file index the type table, plus one, so that maps survive
+# changes to the order of AssetTile.
+MAP_MAGIC = b'DASH'
+MAP_VERSION = 2
+MAP_EXT = '.dmap'
+HEADER = struct.Struct('<4sHHHHII')
+DIR_ENTRY = struct.Struct('<iiII')
+OFFGRID_ENTRY = struct.Struct('<BBdd')
+# Only the cell types and variants are stored, solidity is derived.
+PAYLOAD_BYTES = CHUNK_AREA * 2
+
+
+def is_binary(path):
+    f = open(path, 'rb')
+    magic = f.read(len(MAP_MAGIC))
+    f.close()
+
+    return magic == MAP_MAGIC
+
+
+class MapFile:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.size, chunk_size, type_count, chunk_count, offgrid_count = HEADER.unpack_from(self.data, 0)
+
+        if magic != MAP_MAGIC or version != MAP_VERSION or chunk_size != CHUNK_SIZE:
+            self.close()
+            raise ValueError(f'unsupported map file: {path}')
+
+        offset = HEADER.size
+        self.types = [None]
+
+        for _ in range(type_count):
+            length = self.data[offset]
+            self.types.append(AssetTile[self.data[offset + 1:offset + 1 + length].decode('ascii')])
+            offset += 1 + length
+
+        # Maps the codes used in the file onto the codes used at runtime.
+        self.translation = bytes([0] + [TILE_CODES[type] for type in self.types[1:]] + [0] * (255 - type_count))
+
+        # Chunk offsets and the runtime codes of the types in each chunk.
+        self.directory = {}
+
+        for _ in range(chunk_count):
+            cx, cy, chunk_offset, type_bits = DIR_ENTRY.unpack_from(self.data, offset)
+            self.directory[(cx, cy)] = (chunk_offset, self.translate_bits(type_bits))
+            offset += DIR_ENTRY.size
+
+        self.offgrid = []
+
+        for _ in range(offgrid_count):
+            code, var, x, y = OFFGRID_ENTRY.unpack_from(self.data, offset)
+            self.offgrid.append((self.types[code], var, x, y))
+            offset += OFFGRID_ENTRY.size
+
+    def translate_bits(self, type_bits):
+        bits = 0
+
+        for code in range(1, len(self.types)):
+            if type_bits & (1 << code):
+                bits |= 1 << self.translation[code]
+
+        return bits
+
+    def has_types(self, key, bits):
+        return self.directory[key][1] & bits
+
+    def read_chunk(self, key):
+        offset = self.directory[key][0]
+        chunk = Chunk(key)
+        chunk.types = bytearray(self.data[offset:offset + CHUNK_AREA].translate(self.translation))
+        chunk.vars = bytearray(self.data[offset + CHUNK_AREA:offset + PAYLOAD_BYTES])
+        chunk.solid = chunk.types.translate(SOLID_TABLE)
+        chunk.count = CHUNK_AREA - chunk.types.count(0)
+
+        return chunk
+
+    def cells(self):
+        for key in self.directory:
+            yield from self.read_chunk(key).cells()
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+
+def map_types(path):
+    # The tile types a map uses, without loading it. Binary maps list them
+    # in their type table.
+    if is_binary(path):
+        map_file = MapFile(path)
+        types = set(map_file.types[1:])
+        map_file.close()
+
+        return types
+
+    f = open(path, 'r')
+    map_data = json.load(f)
+    f.close()
+
+    return {AssetTile[tile['type']] for tile in (*map_data['tilemap'].values(), *map_data['offgrid'])}
+
+
+def type_bits(types):
+    # There are far fewer than 32 tile types, so a bit per type code fits the
+    # directory entry.
+    bits = 0
+
+    for code in set(types):
+        bits |= 1 << code
+
+    return bits & ~1
+
+
+def write_binary(path, size, cells, offgrid):
+    # Cells are (x, y, type, var) in grid coordinates and offgrid tiles are
+    # (type, var, x, y) in pixels.
+    chunks = {}
+
+    for x, y, type, var in cells:
+        key = chunk_key(x, y)
+
+        if key not in chunks:
+            chunks[key] = Chunk(key)
+
+        chunks[key].set(cell_index(x, y), type, var)
+
+    offgrid = tuple(offgrid)
+    # The type table is written in runtime order, so cells need no
+    # translation on the way out.
+    types = TILE_TYPES[1:]
+    body = bytearray()
+
+    for type in types:
+        name = type.name.encode('ascii')
+        body += bytes([len(name)]) + name
+
+    offset = HEADER.size + len(body) + DIR_ENTRY.size * len(chunks) + OFFGRID_ENTRY.size * len(offgrid)
+
+    for key, chunk in chunks.items():
+        body += DIR_ENTRY.pack(key[0], key[1], offset, type_bits(chunk.types))
+        offset += PAYLOAD_BYTES
+
+    for type, var, x, y in offgrid:
+        body += OFFGRID_ENTRY.pack(TILE_CODES[type], var, x, y)
+
+    for chunk in chunks.values():
+        body += chunk.types + chunk.vars
+
+    f = open(path, 'wb')
+    f.write(HEADER.pack(MAP_MAGIC, MAP_VERSION, size, CHUNK_SIZE, len(types), len(chunks), len(offgrid)))
+    f.write(body)
+    f.close()
+
+
+def write_json(path, size, cells, offgrid):
+    tilemap = {}
+
+    for x, y, type, var in cells:
+        tilemap[f'{x};{y}'] = {'type': type.name, 'var': var, 'pos': (x, y)}
+
+    f = open(path, 'w')
+    json.dump({
+        'tilemap': tilemap,
+        'size': size,
+        'offgrid': [{'type': type.name, 'var': var, 'pos': (x, y)} for type, var, x, y in offgrid]
+    }, f)
+    f.close()
+
+
+def convert(src, dst):
+    # The destination format is picked by the extension of dst.
+    if is_binary(src):
+        map_file = MapFile(src)
+        size, cells, offgrid = map_file.size, tuple(map_file.cells()), map_file.offgrid
+        map_file.close()
+    else:
+        f = open(src, 'r')
+        map_data = json.load(f)
+        f.close()
+
+        size = map_data['size']
+        cells = [(*tile['pos'], AssetTile[tile['type']], tile['var']) for tile in map_data['tilemap'].values()]
+        offgrid = [(AssetTile[tile['type']], tile['var'], *tile['pos']) for tile in map_data['offgrid']]
+
+    if dst.endswith(MAP_EXT):
+        write_binary(dst, size, cells, offgrid)
+    else:
+        write_json(dst, size, cells, offgrid)
@@ -1,6 +1,11 @@
 import math
 import random
+from itertools import repeat
+from operator import sub
 
+import numpy as np
+
+from scripts.render_queue import Layer
 from scripts.utils import Vec2
 
 
@@ -22,27 +27,125 @@ class ParticleSpawner:
 
 class Particle:
     def __init__(self, game, asset, pos, vel=(0, 0), rand_f=True):
-        self.game = game
         self.asset = asset
         self.pos = pos.deepcopy()
         self.vel = Vec2(vel)
-        self.anim = self.game.assets.get_anim(asset).deepcopy()
+        self.frame = 0
 
         if rand_f:
+            anim = game.assets.get_anim(asset)
             # Reduce by one to avoid the last frame being selected.
-            self.anim.frame = random.randint(0, len(self.anim.images) * (self.anim.img_dur - 1))
+            self.frame = random.randint(0, len(anim.images) * (anim.img_dur - 1))
+
+
+class Particles:
+    def __init__(self, assets):
+        self.assets = assets
+        # Particles are the columns of two arrays, like sparks, so that they
+        # are updated together. parts holds position, velocity and the sine
+        # sway of the position, which is zero for kinds that do not sway.
+        self.parts = np.empty((8, 0))
+        # timing holds the frame, where the particle ends and what frames
+        # are advanced modulo (see AnimData), and where the frame table of
+        # its animation starts in indexes.
+        self.timing = np.empty((4, 0), dtype=np.intp)
+        # Particles are mostly spawned one at a time, so they are gathered
+        # here and joined onto the arrays at once.
+        self.spawned = []
+        # Kinds share the animation of their asset instead of copying it. The
+        # frames of every kind are kept in flat lists, with their outlines
+        # and the offsets that center them. indexes maps the frames of every
+        # kind onto those lists.
+        self.kinds = {}
+        self.sways = {}
+        self.indexes = np.empty(0, dtype=np.intp)
+        self.images = []
+        self.outlines = []
+        self.half_w = np.empty(0)
+        self.half_h = np.empty(0)
+
+    def __len__(self):
+        return self.timing.shape[1] + len(self.spawned)
+
+    def kind(self, asset):
+        if asset not in self.kinds:
+            anim = self.assets.get_anim(asset)
+            self.kinds[asset] = (anim, len(self.indexes))
+            self.indexes = np.append(self.indexes, np.add(anim.indexes, len(self.images), dtype=np.intp))
+            self.images.extend(anim.images)
+            self.outlines.extend(self.assets.get_outline(img) for img in anim.images)
+            self.half_w = np.append(self.half_w, [img.get_width() // 2 for img in anim.images])
+            self.half_h = np.append(self.half_h, [img.get_height() // 2 for img in anim.images])
+
+        return self.kinds[asset]
+
+    def sway(self, asset, speed=Vec2((0, 0)), amp=Vec2((0, 0))):
+        # Particles of the kind spawned from now on drift along a sine of
+        # their animation frame.
+        self.sways[asset] = (speed.x, speed.y, amp.x, amp.y)
 
-    def sin_offset(self, speed=Vec2((0, 0)), amp=Vec2((0, 0))):
-        self.pos = self.pos.add((math.sin(self.anim.frame * speed.x) * amp.x, math.sin(self.anim.frame * speed.y) * amp.y))
+    def append(self, part):
+        anim, table = self.kind(part.asset)
+        sway = self.sways.get(part.asset, (0, 0, 0, 0))
+        self.spawned.append(((part.pos.x, part.pos.y, part.vel.x, part.vel.y) + sway,
+                             (part.frame, anim.frame_max, anim.wrap, table)))
+
+    def extend(self, parts):
+        for part in parts:
+            self.append(part)
+
+    def join(self):
+        if self.spawned:
+            parts, timing = zip(*self.spawned)
+            self.parts = np.concatenate((self.parts, np.array(parts).T), axis=1)
+            self.timing = np.concatenate((self.timing, np.array(timing, dtype=np.intp).T), axis=1)
+            self.spawned.clear()
+
+    def clear(self):
+        self.parts = self.parts[:, :0]
+        self.timing = self.timing[:, :0]
+        self.spawned.clear()
 
     def update(self):
-        self.pos = self.pos.add(self.vel)
-        self.anim.update()
+        self.join()
+        x, y, _, _, sway_speed_x, sway_speed_y, sway_amp_x, sway_amp_y = self.parts
+        frame = self.timing[0]
+
+        if sway_amp_x.any():
+            x += np.sin(frame * sway_speed_x) * sway_amp_x
+
+        if sway_amp_y.any():
+            y += np.sin(frame * sway_speed_y) * sway_amp_y
+
+        alive = frame < self.timing[1]
+        self.parts = self.parts[:, alive]
+        self.timing = self.timing[:, alive]
+        x, y, vel_x, vel_y = self.parts[:4]
+        frame, _, wrap, _ = self.timing
+        x += vel_x
+        y += vel_y
+        frame += 1
+        frame %= wrap
+
+    def render(self, game, offset=Vec2((0, 0))):
+        self.join()
+        x, y = self.parts[:2]
+        frame, _, _, table = self.timing
+        # Particles reach at most their largest frame, and its outline, from
+        # their position.
+        left, top, right, bottom = game.camera.bounds(max(self.half_w.max(initial=0), self.half_h.max(initial=0)) + 1)
+        # Only the particles near the display are drawn.
+        visible = (left < x) & (x < right) & (top < y) & (y < bottom)
+        frames = self.indexes[table[visible] + frame[visible]]
+        # Frames are centered on the position and offset, blits truncate.
+        xs = (x[visible] - (offset[0] + self.half_w[frames])).astype(int).tolist()
+        ys = (y[visible] - (offset[1] + self.half_h[frames])).astype(int).tolist()
+        frames = frames.tolist()
+        blits = list(zip(map(self.images.__getitem__, frames), zip(xs, ys)))
+        outline_blits = list(zip(map(self.outlines.__getitem__, frames),
+                                 zip(map(sub, xs, repeat(1)), map(sub, ys, repeat(1)))))
 
-    def render(self):
-        img = self.anim.img()
-        pos = self.pos.sub((self.game.render_scroll.x + img.get_width() // 2, self.game.render_scroll.y + img.get_height() // 2)).tuple()
-        self.game.fore_d.blit(img, pos)
+        game.draw_batch(blits, outline_blits, Layer.PARTICLES)
 
 
 class PartFactory:
@@ -0,0 +1,108 @@
+import math
+import time
+
+import pygame
+
+
+class Presenter:
+    def __init__(self, res_base, res_scale, native=False):
+        self.res_base = res_base
+        self.res_scale = res_scale
+        # Native presentation hands the base resolution to SDL and lets it do
+        # the scaling, usually on the GPU.
+        self.native = native
+        # Whole scales turn every pixel into a block of the same size, so the
+        # display can be scaled straight into the screen.
+        self.integer = float(res_scale).is_integer()
+        # How long the last call to present() took.
+        self.present_ms = 0
+        self.scaled = None
+
+        if native:
+            self.screen = pygame.display.set_mode(res_base, pygame.SCALED)
+        else:
+            self.screen = pygame.display.set_mode((int(res_base[0] * res_scale), int(res_base[1] * res_scale)))
+
+            if not self.integer:
+                # Scaled into once per frame, rather than allocating a new
+                # surface every time.
+                self.scaled = pygame.Surface(self.screen.get_size()).convert()
+
+    def mouse_pos(self):
+        # The mouse position in base resolution pixels.
+        x, y = pygame.mouse.get_pos()
+
+        if self.native:
+            return (x, y)
+
+        return (x / self.res_scale, y / self.res_scale)
+
+    def present(self, surf, offset=(0, 0)):
+        start = time.perf_counter()
+
+        if self.native:
+            self.screen.blit(surf, (int(offset[0] / self.res_scale), int(offset[1] / self.res_scale)))
+        elif self.integer:
+            self.present_integer(surf, offset)
+        else:
+            pygame.transform.scale(surf, self.scaled.get_size(), self.scaled)
+            self.screen.blit(self.scaled, offset)
+
+        pygame.display.update()
+        self.present_ms = (time.perf_counter() - start) * 1000
+
+    def present_rects(self, surf, rects):
+        # Presents only the given areas of surf, the rest of the screen is
+        # expected to still hold the previous frame.
+        start = time.perf_counter()
+        screen_rects = []
+
+        if not self.native and not self.integer:
+            pygame.transform.scale(surf, self.scaled.get_size(), self.scaled)
+
+        for rect in rects:
+            rect = rect.clip(surf.get_rect())
+
+            if not rect:
+                continue
+
+            if self.native:
+                self.screen.blit(surf, rect, rect)
+                screen_rects.append(rect)
+            elif self.integer:
+                scale = int(self.res_scale)
+                screen_rect = pygame.Rect(rect.x * scale, rect.y * scale, rect.width * scale, rect.height * scale)
+                pygame.transform.scale(surf.subsurface(rect), screen_rect.size, self.screen.subsurface(screen_rect))
+                screen_rects.append(screen_rect)
+            else:
+                # Fractional scales do not line up with the pixels of surf, so
+                # the area is grown to whole screen pixels.
+                left = int(rect.left * self.res_scale)
+                top = int(rect.top * self.res_scale)
+                screen_rect = pygame.Rect(left, top, math.ceil(rect.right * self.res_scale) - left,
+                                          math.ceil(rect.bottom * self.res_scale) - top).clip(self.screen.get_rect())
+                self.screen.blit(self.scaled, screen_rect, screen_rect)
+                screen_rects.append(screen_rect)
+
+        pygame.display.update(screen_rects)
+        self.present_ms = (time.perf_counter() - start) * 1000
+
+    def present_integer(self, surf, offset):
+        scale = int(self.res_scale)
+        # The offset is snapped to whole pixels of the display, then the part
+        # that remains visible is scaled straight into the matching part of
+        # the screen.
+        dx = int(offset[0] / scale)
+        dy = int(offset[1] / scale)
+
+        if not dx and not dy:
+            pygame.transform.scale(surf, self.screen.get_size(), self.screen)
+            return
+
+        src = pygame.Rect(max(0, -dx), max(0, -dy), surf.get_width() - abs(dx), surf.get_height() - abs(dy))
+
+        if src.width <= 0 or src.height <= 0:
+            return
+
+        dst = self.screen.subsurface((max(0, dx) * scale, max(0, dy) * scale, src.width * scale, src.height * scale))
+        pygame.transform.scale(surf.subsurface(src), dst.get_size(), dst)
@@ -1,8 +1,13 @@
 from scripts.utils import Vec2
 
 
+PROJ_LIFETIME = 360
+
+
 class Proj:
-    def __init__(self, pos=Vec2((0, 0)), vel=Vec2((0, 0))):
+    def __init__(self, pos=Vec2((0, 0)), vel=Vec2((0, 0)), impact=None):
         self.pos = pos.deepcopy()
         self.vel = vel.deepcopy()
         self.timer = 0
+        # The frame the projectile hits a wall, or None if it never does.
+        self.impact = impact
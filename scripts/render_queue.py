@@ -0,0 +1,81 @@
+from enum import Enum
+
+import pygame
+
+
+class Layer(Enum):
+    CLOUDS = 0
+    TILEMAP = 1
+    ENTITIES = 2
+    PROJECTILES = 3
+    SPARKS = 4
+    PARTICLES = 5
+    PREVIEW = 6
+    TRANSITION = 7
+
+
+# Layers whose draws are ordered by their y, so that what stands lower is
+# drawn in front.
+SORTED_LAYERS = {Layer.ENTITIES}
+
+BLIT = 0
+BATCH = 1
+POLYGON = 2
+
+
+class RenderQueue:
+    def __init__(self):
+        # Draw commands of the current frame, submitted back to front by
+        # layer.
+        self.layers = {layer: [] for layer in Layer}
+        # Draws and outline draws per layer in the last submitted frame.
+        self.counts = {layer: 0 for layer in Layer}
+        self.outline_counts = {layer: 0 for layer in Layer}
+
+    def push(self, layer, target, img, pos, y=0, outline=False):
+        self.layers[layer].append((y, BLIT, target, img, pos, outline))
+
+    def push_batch(self, layer, target, blits, y=0, outline=False):
+        self.layers[layer].append((y, BATCH, target, blits, None, outline))
+
+    def push_polygon(self, layer, target, color, points, y=0):
+        self.layers[layer].append((y, POLYGON, target, color, points, False))
+
+    def submit(self):
+        # Consecutive blits to the same target go out as one fblits call,
+        # only other kinds of draws split the batch. Returns the rects of
+        # the polygons drawn, since those have no cached outline.
+        batches = {}
+        rects = []
+
+        for layer, commands in self.layers.items():
+            counts = [0, 0]
+
+            for command in commands:
+                counts[command[5]] += len(command[3]) if command[1] == BATCH else 1
+
+            self.counts[layer], self.outline_counts[layer] = counts
+
+            if layer in SORTED_LAYERS:
+                commands.sort(key=lambda command: command[0])
+
+            for _, kind, target, a, b, _ in commands:
+                if kind == BLIT:
+                    batches.setdefault(target, []).append((a, b))
+                    continue
+
+                if kind == BATCH:
+                    batches.setdefault(target, []).extend(a)
+                    continue
+
+                if batches.get(target):
+                    target.fblits(batches.pop(target))
+
+                rects.append(pygame.draw.polygon(target, a, b))
+
+            commands.clear()
+
+        for target, blits in batches.items():
+            target.fblits(blits)
+
+        return rects
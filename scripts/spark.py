@@ -1,22 +1,12 @@
 import math
 import random
 
-import pygame
+import numpy as np
 
+from scripts.render_queue import Layer
 from scripts.utils import Vec2
 
 
-def get_diamond_polygon_points(pos, angle, speed, offset=Vec2((0, 0))):
-    return ((pos.x + math.cos(angle) * speed * 3 - offset.x,
-             pos.y + math.sin(angle) * speed * 3 - offset.y),
-            (pos.x + math.cos(angle + math.pi * 0.5) * speed * 0.5 - offset.x,
-             pos.y + math.sin(angle + math.pi * 0.5) * speed * 0.5 - offset.y),
-            (pos.x + math.cos(angle + math.pi) * speed * 3 - offset.x,
-             pos.y + math.sin(angle + math.pi) * speed * 3 - offset.y),
-            (pos.x + math.cos(angle - math.pi) * speed * 0.5 - offset.x,
-             pos.y + math.sin(angle - math.pi) * speed * 0.5 - offset.y))
-
-
 class Spark:
     def __init__(self, pos=Vec2((0, 0)), angle=0, speed=0):
         self.pos = pos.deepcopy()
@@ -25,17 +15,60 @@ class Spark:
         self.angle = angle
         self.speed = speed
 
-    def update(self):
-        self.pos.x += math.cos(self.angle) * self.speed
-        self.pos.y += math.sin(self.angle) * self.speed
 
-        self.speed = max(0, self.speed - 0.1)
+class Sparks:
+    def __init__(self):
+        # Sparks are the columns of one array, with a row for position,
+        # direction and speed each, so that they are moved, slowed down and
+        # culled together. The direction of travel is only turned into a
+        # vector once, at spawn.
+        self.sparks = np.empty((5, 0))
+
+    def __len__(self):
+        return self.sparks.shape[1]
 
-        return not self.speed
+    def append(self, spark):
+        self.extend((spark,))
 
-    def render(self, surf, offset=Vec2((0, 0))):
-        points = get_diamond_polygon_points(self.pos, self.angle, self.speed, offset)
-        pygame.draw.polygon(surf, (255, 255, 255), points)
+    def extend(self, sparks):
+        columns = [(spark.pos.x, spark.pos.y, math.cos(spark.angle), math.sin(spark.angle), spark.speed)
+                   for spark in sparks]
+
+        if columns:
+            self.sparks = np.concatenate((self.sparks, np.array(columns).T), axis=1)
+
+    def update(self):
+        x, y, cos, sin, speed = self.sparks
+        x += cos * speed
+        y += sin * speed
+        np.maximum(speed - 0.1, 0, out=speed)
+        self.sparks = self.sparks[:, speed > 0]
+
+    def render(self, game, offset=Vec2((0, 0))):
+        x, y, _, _, speed = self.sparks
+
+        if not len(speed):
+            return
+
+        # Sparks reach at most three times their speed from their position.
+        left, top, right, bottom = game.camera.bounds(speed.max() * 3)
+        x, y, cos, sin, speed = self.sparks[:, (left < x) & (x < right) & (top < y) & (y < bottom)]
+        pos_x = x - offset[0]
+        pos_y = y - offset[1]
+        # A diamond along the direction of travel, the last point sits on the
+        # same axis as the first and third.
+        long_x = cos * speed * 3
+        long_y = sin * speed * 3
+        short_x = cos * speed * 0.5
+        short_y = sin * speed * 0.5
+        polygons = np.stack((pos_x + long_x, pos_y + long_y,
+                             pos_x - short_y, pos_y + short_x,
+                             pos_x - long_x, pos_y - long_y,
+                             pos_x - short_x, pos_y - short_y), axis=1).reshape(-1, 4, 2)
+        draw_polygon = game.draw_polygon
+
+        for points in polygons.tolist():
+            draw_polygon((255, 255, 255), points, Layer.SPARKS)
 
 
 class SparkFactory:
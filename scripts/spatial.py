@@ -0,0 +1,69 @@
+import pygame
+
+
+class SpatialHash:
+    def __init__(self, cell=64):
+        self.cell = cell
+        # Items are bucketed by every grid cell their rect overlaps.
+        self.buckets = {}
+        self.rects = {}
+        # Queries return items in insertion order, which is also the order
+        # they are rendered in.
+        self.order = {}
+        self.count = 0
+
+    def __iter__(self):
+        return iter(tuple(self.rects))
+
+    def __len__(self):
+        return len(self.rects)
+
+    def keys(self, rect):
+        cell = self.cell
+
+        for bx in range(rect.left // cell, (rect.right - 1) // cell + 1):
+            for by in range(rect.top // cell, (rect.bottom - 1) // cell + 1):
+                yield (bx, by)
+
+    def insert(self, item, rect):
+        rect = pygame.Rect(rect)
+        self.rects[item] = rect
+        self.order[item] = self.count
+        self.count += 1
+
+        for key in self.keys(rect):
+            self.buckets.setdefault(key, []).append(item)
+
+    def remove(self, item):
+        rect = self.rects.pop(item)
+        del self.order[item]
+
+        for key in self.keys(rect):
+            bucket = self.buckets[key]
+            bucket.remove(item)
+
+            if not bucket:
+                del self.buckets[key]
+
+    def rect(self, item):
+        return self.rects[item]
+
+    def query_rect(self, rect):
+        rect = pygame.Rect(rect)
+        found = {}
+
+        for key in self.keys(rect):
+            for item in self.buckets.get(key, ()):
+                if item not in found and rect.colliderect(self.rects[item]):
+                    found[item] = True
+
+        return sorted(found, key=self.order.__getitem__)
+
+    def query_point(self, pos):
+        items = []
+
+        for item in self.buckets.get((int(pos[0] // self.cell), int(pos[1] // self.cell)), ()):
+            if self.rects[item].collidepoint(pos):
+                items.append(item)
+
+        return sorted(items, key=self.order.__getitem__)
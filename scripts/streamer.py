@@ -0,0 +1,152 @@
+import math
+import queue
+import threading
+from collections import OrderedDict
+
+from scripts.chunk import CHUNK_BYTES
+
+
+class ChunkStreamer:
+    def __init__(self, tilemap, radius=2, budget=1 << 22, lookahead=30):
+        self.tilemap = tilemap
+        # Radius, in chunks, around the camera that is kept resident.
+        self.radius = radius
+        # Resident chunk data and baked chunk surfaces are counted against
+        # the budget, in bytes.
+        self.budget = budget
+        # How many frames ahead of the camera's travel to load.
+        self.lookahead = lookahead
+        # Resident chunks, least recently used first.
+        self.lru = OrderedDict()
+        self.queued = set()
+        self.last = None
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def work(self):
+        while True:
+            request = self.requests.get()
+
+            if request is None:
+                return
+
+            source, key = request
+
+            try:
+                self.results.put((source, key, source.read_chunk(key)))
+            except ValueError:
+                # The source was closed while the request was queued.
+                pass
+
+    def stop(self):
+        self.requests.put(None)
+
+    def reset(self):
+        self.lru = OrderedDict()
+        self.queued = set()
+        self.last = None
+
+    def touch(self, key):
+        self.lru[key] = None
+        self.lru.move_to_end(key)
+
+    def keys_around(self, center_x, center_y):
+        radius = self.radius
+
+        for cx in range(math.floor(center_x - radius), math.floor(center_x + radius) + 1):
+            for cy in range(math.floor(center_y - radius), math.floor(center_y + radius) + 1):
+                yield (cx, cy)
+
+    def update(self, offset, view_size):
+        tilemap = self.tilemap
+
+        if tilemap.source is None:
+            return
+
+        self.collect()
+
+        chunk_px = tilemap.cache.chunk_px()
+        center_x = (offset[0] + view_size[0] / 2) / chunk_px
+        center_y = (offset[1] + view_size[1] / 2) / chunk_px
+
+        # The camera's travel since the last update decides where to look
+        # ahead.
+        if self.last is None:
+            self.last = (center_x, center_y)
+
+        ahead_x = center_x + (center_x - self.last[0]) * self.lookahead
+        ahead_y = center_y + (center_y - self.last[1]) * self.lookahead
+        self.last = (center_x, center_y)
+
+        wanted = set(self.keys_around(center_x, center_y))
+
+        for key in wanted:
+            if key in tilemap.chunks:
+                self.touch(key)
+
+        # Request the closest chunks to where the camera is heading first.
+        ahead = wanted | set(self.keys_around(ahead_x, ahead_y))
+
+        for key in sorted(ahead, key=lambda key: (key[0] - ahead_x) ** 2 + (key[1] - ahead_y) ** 2):
+            if key in tilemap.pending and key not in self.queued:
+                self.queued.add(key)
+                self.requests.put((tilemap.source, key))
+
+        self.evict(ahead)
+
+    def collect(self):
+        tilemap = self.tilemap
+
+        while True:
+            try:
+                source, key, chunk = self.results.get_nowait()
+            except queue.Empty:
+                return
+
+            self.queued.discard(key)
+
+            # The chunk may have been loaded synchronously in the meantime, or
+            # belong to a map that is no longer loaded.
+            if source is tilemap.source and key in tilemap.pending:
+                tilemap.insert_chunk(chunk)
+
+    def evict(self, keep):
+        tilemap = self.tilemap
+        cache = tilemap.cache
+        surfs = []
+
+        for key, surf in tuple(cache.surfs.items()):
+            if surf is not None:
+                surfs.append(key)
+            elif key not in keep:
+                # Forget about empty chunks that are out of range.
+                cache.invalidate(key)
+
+        resident = len(tilemap.chunks) * CHUNK_BYTES + sum(cache.baked_bytes(key) for key in surfs)
+
+        for key in tuple(self.lru):
+            if resident <= self.budget:
+                return
+
+            # Edited chunks are pinned, since the source no longer matches
+            # them.
+            if key in keep or key in tilemap.modified:
+                continue
+
+            del self.lru[key]
+            resident -= cache.baked_bytes(key)
+
+            if tilemap.evict_chunk(key):
+                resident -= CHUNK_BYTES
+
+        # Baked surfaces of chunks without grid tiles are not tracked by the
+        # LRU, but still count against the budget.
+        for key in surfs:
+            if resident <= self.budget:
+                return
+
+            if key not in keep and key in cache.surfs:
+                resident -= cache.baked_bytes(key)
+                cache.invalidate(key)
@@ -1,9 +1,17 @@
 import json
+import math
 
+import numpy as np
 import pygame
 
 from scripts.assets import AssetTile
+from scripts.autotile import Autotiler
+from scripts.chunk import CHUNK_AREA, CHUNK_MASK, CHUNK_SHIFT, TILE_CODES, TILE_TYPES, Chunk, cell_index, chunk_key
+from scripts.chunk_cache import ChunkCache
 from scripts.encoder import Encoder
+from scripts.mapfile import MAP_EXT, MapFile, is_binary, write_binary
+from scripts.spatial import SpatialHash
+from scripts.streamer import ChunkStreamer
 from scripts.tile import Tile
 from scripts.utils import Vec2
 
@@ -17,134 +25,623 @@ NEIGHBOR_OFFSETS = (
     Vec2((-1, 1)),
     Vec2((0, 1)),
     Vec2((1, 1)))
-PHYSICS_TILES = {
-    AssetTile.GRASS,
-    AssetTile.STONE
-}
-AUTOTILE_TYPES = {
-    AssetTile.GRASS,
-    AssetTile.STONE
-}
-AUTOTILE_MAP = {
-    tuple(sorted([(1, 0), (0, 1)])): 0,
-    tuple(sorted([(1, 0), (0, 1), (-1, 0)])): 1,
-    tuple(sorted([(-1, 0), (0, 1)])): 2,
-    tuple(sorted([(-1, 0), (0, -1), (0, 1)])): 3,
-    tuple(sorted([(-1, 0), (0, -1)])): 4,
-    tuple(sorted([(-1, 0), (0, -1), (1, 0)])): 5,
-    tuple(sorted([(1, 0), (0, -1)])): 6,
-    tuple(sorted([(1, 0), (0, -1), (0, 1)])): 7,
-    tuple(sorted([(1, 0), (-1, 0), (0, 1), (0, -1)])): 8,
-}
+# Fewer rays than this are cast one by one by raycast_batch(), which is
+# faster than setting up the arrays for them.
+RAYCAST_BATCH = 200
 
 
 class Tilemap:
     def __init__(self, game, size=16):
         self.game = game
         self.size = size
-        self.tilemap = {}
-        self.offgrid = []
+        # Grid tiles are stored in chunks keyed by integer chunk coordinates.
+        self.chunks = {}
+        # Offgrid tiles are indexed by the area their image covers.
+        self.offgrid = SpatialHash(cell=size * 4)
+        self.cache = ChunkCache(self)
+        # Binary maps are memory-mapped and their chunks are only decoded
+        # once something touches them.
+        self.source = None
+        self.pending = set()
+        # Chunks edited since the map was loaded differ from the source.
+        self.modified = set()
+        self.streamer = None
+        self.autotiler = Autotiler(self)
+        # Locations of every resident tile keyed by (type, var), grid tiles by
+        # cell and offgrid tiles by the tile itself.
+        self.grid_index = {}
+        self.offgrid_index = {}
+
+    def stream(self, radius=2, budget=1 << 22, lookahead=30):
+        # Keeps only the chunks around the camera resident, this only has an
+        # effect on binary maps since those can be read back on demand.
+        if self.streamer:
+            self.streamer.stop()
+
+        self.streamer = ChunkStreamer(self, radius, budget, lookahead)
+
+    def update(self):
+        if self.streamer:
+            self.streamer.update(self.game.camera.render_scroll, self.game.fore_d.get_size())
+
+    def clear(self):
+        self.close_source()
+        self.chunks = {}
+        self.modified = set()
+        self.grid_index = {}
+        self.offgrid_index = {}
+
+        if self.streamer:
+            self.streamer.reset()
+
+        self.offgrid = SpatialHash(cell=self.size * 4)
+        self.cache.reset()
+
+    def close_source(self):
+        if self.source:
+            self.source.close()
+
+        self.source = None
+        self.pending = set()
 
     def save(self, path):
+        # Every chunk has to be decoded before the source may be replaced.
+        self.load_all()
+        self.close_source()
+
+        if path.endswith(MAP_EXT):
+            write_binary(path, self.size, self.cells(),
+                         ((tile.type, tile.var, tile.pos.x, tile.pos.y) for tile in self.offgrid))
+            return
+
         f = open(path, 'w')
         json.dump({
-            'tilemap': self.tilemap,
+            'tilemap': {tile.pos.json(): tile for tile in self.tiles()},
             'size': self.size,
-            'offgrid': self.offgrid
+            'offgrid': tuple(self.offgrid)
         }, f, cls=Encoder)
         f.close()
 
     def load(self, path):
+        # The format is detected from the file contents.
+        if is_binary(path):
+            self.load_binary(path)
+        else:
+            self.load_json(path)
+
+    def load_binary(self, path):
+        source = MapFile(path)
+        self.size = source.size
+        self.clear()
+        self.source = source
+        self.pending = set(source.directory)
+        self.cache.add_types(source.types[1:])
+
+        for tile_type, tile_var, x, y in source.offgrid:
+            self.place_offgrid(Tile(tile_type, tile_var, Vec2((x, y))))
+
+    def load_json(self, path):
         f = open(path, 'r')
         map_data = json.load(f)
         f.close()
 
+        self.size = map_data['size']
+        self.clear()
+
         for tile in map_data['tilemap'].values():
             tile_type = AssetTile[tile['type']]
             tile_var = tile['var']
             tile_pos = Vec2(tile['pos'])
-            self.tilemap[tile_pos.json()] = Tile(tile_type, tile_var, tile_pos)
-
-        self.size = map_data['size']
+            self.place(Tile(tile_type, tile_var, tile_pos))
 
         for tile in map_data['offgrid']:
             tile_type = AssetTile[tile['type']]
             tile_var = tile['var']
             tile_pos = Vec2(tile['pos'])
-            self.offgrid.append(Tile(tile_type, tile_var, tile_pos))
+            self.place_offgrid(Tile(tile_type, tile_var, tile_pos))
 
-    def solid_check(self, pos=Vec2((0, 0))):
-        tile_loc = pos.div_f(self.size).int().json()
+    def get_chunk(self, key):
+        chunk = self.chunks.get(key)
 
-        if tile_loc in self.tilemap:
-            if self.tilemap[tile_loc].type in PHYSICS_TILES:
-                return self.tilemap[tile_loc]
+        if chunk is None and key in self.pending:
+            chunk = self.load_chunk(key)
 
-    def extract(self, pairs, keep=False):
-        matches = []
+        return chunk
+
+    def load_chunk(self, key):
+        return self.insert_chunk(self.source.read_chunk(key))
+
+    def insert_chunk(self, chunk):
+        self.pending.discard(chunk.pos)
+        self.chunks[chunk.pos] = chunk
+        self.index_chunk(chunk)
+
+        if self.streamer:
+            self.streamer.touch(chunk.pos)
+
+        return chunk
+
+    def evict_chunk(self, key):
+        chunk = self.chunks.pop(key, None)
+        self.cache.invalidate(key)
+
+        if chunk:
+            self.unindex_chunk(chunk)
+
+        if self.source and key in self.source.directory:
+            self.pending.add(key)
+
+        return chunk
+
+    def load_all(self):
+        for key in tuple(self.pending):
+            self.load_chunk(key)
+
+    def load_types(self, types):
+        # Decodes only the pending chunks that contain any of the types.
+        bits = 0
+
+        for type in types:
+            bits |= 1 << TILE_CODES[type]
+
+        for key in tuple(self.pending):
+            if self.source.has_types(key, bits):
+                self.load_chunk(key)
+
+    def index_cell(self, x, y, type, var):
+        self.grid_index.setdefault((type, var), set()).add((x, y))
+
+    def unindex_cell(self, x, y, type, var):
+        cells = self.grid_index.get((type, var))
+
+        if cells:
+            cells.discard((x, y))
+
+            if not cells:
+                del self.grid_index[(type, var)]
+
+    def index_chunk(self, chunk):
+        for x, y, type, var in chunk.cells():
+            self.index_cell(x, y, type, var)
+
+    def unindex_chunk(self, chunk):
+        for x, y, type, var in chunk.cells():
+            self.unindex_cell(x, y, type, var)
+
+    def set_var(self, chunk, x, y, var):
+        index = cell_index(x, y)
+        type = TILE_TYPES[chunk.types[index]]
+        self.unindex_cell(x, y, type, chunk.vars[index])
+        chunk.vars[index] = var
+        self.index_cell(x, y, type, var)
+        self.modified.add(chunk.pos)
+        self.cache.invalidate_cell(x, y)
+
+    def place(self, tile):
+        x, y = tile.pos
+        key = chunk_key(x, y)
+        chunk = self.get_chunk(key)
+
+        if chunk is None:
+            chunk = self.chunks[key] = Chunk(key)
+
+        index = cell_index(x, y)
+
+        if chunk.types[index]:
+            self.unindex_cell(x, y, TILE_TYPES[chunk.types[index]], chunk.vars[index])
+
+        chunk.set(index, tile.type, tile.var)
+        self.index_cell(x, y, tile.type, tile.var)
+        self.modified.add(key)
+        self.cache.add_types((tile.type,))
+        self.cache.invalidate_cell(x, y)
+        self.autotiler.dirty(x, y)
+
+    def remove(self, x, y):
+        key = chunk_key(x, y)
+        chunk = self.get_chunk(key)
+
+        if chunk is not None:
+            index = cell_index(x, y)
+
+            if chunk.types[index]:
+                self.unindex_cell(x, y, TILE_TYPES[chunk.types[index]], chunk.vars[index])
+
+            chunk.remove(index)
+            self.modified.add(key)
+            self.cache.invalidate_cell(x, y)
+
+            if not chunk.count:
+                del self.chunks[key]
+
+            self.autotiler.dirty(x, y)
 
-        for tile in self.offgrid.copy():
-            if (tile.type, tile.var) in pairs:
-                matches.append(tile.deepcopy())
+    def place_offgrid(self, tile):
+        img = self.game.assets.get_tiles(tile.type, tile.var)
+        self.offgrid.insert(tile, (tile.pos.x, tile.pos.y, *img.get_size()))
+        self.offgrid_index.setdefault((tile.type, tile.var), set()).add(tile)
+        self.cache.invalidate_rect(*self.offgrid.rect(tile))
 
-                if not keep:
-                    self.offgrid.remove(tile)
+    def remove_offgrid(self, tile):
+        self.cache.invalidate_rect(*self.offgrid.rect(tile))
+        self.offgrid.remove(tile)
+        tiles = self.offgrid_index[(tile.type, tile.var)]
+        tiles.discard(tile)
 
-        for loc in self.tilemap:
-            tile = self.tilemap[loc]
+        if not tiles:
+            del self.offgrid_index[(tile.type, tile.var)]
 
-            if (tile.type, tile.var) in pairs:
-                matches.append(tile.deepcopy())
-                matches[-1].pos = matches[-1].pos.mult(self.size)
+    def offgrid_in_rect(self, rect):
+        return self.offgrid.query_rect(rect)
 
-                if not keep:
-                    del self.tilemap[loc]
+    def offgrid_at(self, pos):
+        return self.offgrid.query_point(pos)
+
+    def get_code(self, x, y):
+        key = (x >> CHUNK_SHIFT, y >> CHUNK_SHIFT)
+        chunk = self.chunks.get(key)
+
+        if chunk is None and self.pending:
+            chunk = self.get_chunk(key)
+
+        if chunk is not None:
+            return chunk.types[((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)]
+
+        return 0
+
+    def get_type(self, x, y):
+        return TILE_TYPES[self.get_code(x, y)]
+
+    def get_tile(self, x, y):
+        chunk = self.get_chunk((x >> CHUNK_SHIFT, y >> CHUNK_SHIFT))
+
+        if chunk is not None:
+            index = ((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)
+
+            if chunk.types[index]:
+                return Tile(TILE_TYPES[chunk.types[index]], chunk.vars[index], Vec2((x, y)))
+
+    def cells(self):
+        self.load_all()
+
+        for chunk in tuple(self.chunks.values()):
+            yield from chunk.cells()
+
+    def tiles(self):
+        for x, y, type, var in self.cells():
+            yield Tile(type, var, Vec2((x, y)))
+
+    def cells_in(self, left, top, right, bottom):
+        # Yields the cell coordinates, type code and variant of every tile
+        # within the inclusive cell bounds, one chunk at a time.
+        for cx in range(left >> CHUNK_SHIFT, (right >> CHUNK_SHIFT) + 1):
+            for cy in range(top >> CHUNK_SHIFT, (bottom >> CHUNK_SHIFT) + 1):
+                chunk = self.get_chunk((cx, cy))
+
+                if chunk is None:
+                    continue
+
+                types = chunk.types
+                vars = chunk.vars
+                base_x = cx << CHUNK_SHIFT
+                base_y = cy << CHUNK_SHIFT
+
+                for x in range(max(left, base_x), min(right, base_x + CHUNK_MASK) + 1):
+                    for y in range(max(top, base_y), min(bottom, base_y + CHUNK_MASK) + 1):
+                        index = ((y - base_y) << CHUNK_SHIFT) | (x - base_x)
+
+                        if types[index]:
+                            yield x, y, types[index], vars[index]
+
+    def tiles_in_rect(self, rect):
+        # The rect is given in pixels and may be any rect-like sequence.
+        left, top, width, height = rect
+        tiles = []
+
+        for x, y, code, var in self.cells_in(int(left // self.size), int(top // self.size),
+                                             int((left + width - 1) // self.size), int((top + height - 1) // self.size)):
+            tiles.append(Tile(TILE_TYPES[code], var, Vec2((x, y))))
+
+        return tuple(tiles)
+
+    def is_solid(self, x, y):
+        key = (x >> CHUNK_SHIFT, y >> CHUNK_SHIFT)
+        chunk = self.chunks.get(key)
+
+        if chunk is None and self.pending:
+            chunk = self.get_chunk(key)
+
+        if chunk is not None:
+            return chunk.solid[((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)]
+
+        return 0
+
+    def solid_check(self, pos=Vec2((0, 0))):
+        return bool(self.is_solid(int(pos[0] // self.size), int(pos[1] // self.size)))
+
+    def sweep_x(self, x, y, width, height, dx):
+        # Moves the rect (x, y, width, height) horizontally by dx and returns
+        # the resolved x. Every column between the start and the end of the
+        # move is checked, so moves wider than a tile can't tunnel through.
+        new_x = x + dx
+
+        if not dx:
+            return new_x
+
+        size = self.size
+        is_solid = self.is_solid
+        # Rects truncate their position, so the collision checks do as well.
+        top = int(y) // size
+        bottom = (int(y) + height - 1) // size
+
+        if dx > 0:
+            for col in range((int(x) + width - 1) // size, (int(new_x) + width - 1) // size + 1):
+                for row in range(top, bottom + 1):
+                    if is_solid(col, row):
+                        return col * size - width
+        else:
+            for col in range(int(x) // size, int(new_x) // size - 1, -1):
+                for row in range(top, bottom + 1):
+                    if is_solid(col, row):
+                        return (col + 1) * size
+
+        return new_x
+
+    def sweep_y(self, x, y, width, height, dy):
+        # The vertical counterpart of sweep_x.
+        new_y = y + dy
+
+        if not dy:
+            return new_y
+
+        size = self.size
+        is_solid = self.is_solid
+        left = int(x) // size
+        right = (int(x) + width - 1) // size
+
+        if dy > 0:
+            for row in range((int(y) + height - 1) // size, (int(new_y) + height - 1) // size + 1):
+                for col in range(left, right + 1):
+                    if is_solid(col, row):
+                        return row * size - height
+        else:
+            for row in range(int(y) // size, int(new_y) // size - 1, -1):
+                for col in range(left, right + 1):
+                    if is_solid(col, row):
+                        return (row + 1) * size
+
+        return new_y
+
+    def extract(self, pairs, keep=False, rect=None):
+        # Lookups go through the (type, var) index, so the cost follows the
+        # number of matches rather than the size of the map. Restricting the
+        # search to a rect (in pixels) filters the matches further.
+        if self.pending:
+            self.load_types({type for type, _ in pairs})
+
+        if rect is not None:
+            rect = pygame.Rect(rect)
+
+        offgrid = []
+        cells = []
+
+        for pair in pairs:
+            for tile in self.offgrid_index.get(pair, ()):
+                if rect is None or rect.colliderect(self.offgrid.rect(tile)):
+                    offgrid.append(tile)
+
+            for x, y in self.grid_index.get(pair, ()):
+                if rect is None or rect.colliderect((x * self.size, y * self.size, self.size, self.size)):
+                    cells.append((x, y, pair))
+
+        # Keep the map's order, offgrid tiles as placed and grid tiles row by
+        # row.
+        offgrid.sort(key=self.offgrid.order.__getitem__)
+        cells.sort(key=lambda cell: (cell[1], cell[0]))
+        matches = []
+
+        for tile in offgrid:
+            matches.append(tile.deepcopy())
+
+            if not keep:
+                self.remove_offgrid(tile)
+
+        for x, y, (type, var) in cells:
+            matches.append(Tile(type, var, Vec2((x * self.size, y * self.size))))
+
+            if not keep:
+                self.remove(x, y)
 
         return matches
 
-    def automap(self):
-        for loc in self.tilemap:
-            tile = self.tilemap[loc]
-            neighbors = set()
+    def find(self, type, var=None):
+        # All tiles of a type, or of a single variant of it, in the same form
+        # extract() returns them.
+        if self.pending:
+            self.load_types({type})
 
-            for shift in [(1, 0), (-1, 0), (0, -1), (0, 1)]:
-                check_loc = tile.pos.add(shift).json()
+        pairs = {pair for pair in (*self.grid_index, *self.offgrid_index) if pair[0] == type}
 
-                if check_loc in self.tilemap:
-                    if self.tilemap[check_loc].type == tile.type:
-                        neighbors.add(shift)
+        if var is not None:
+            pairs = {(type, var)}
 
-            neighbors = tuple(sorted(neighbors))
+        return self.extract(pairs, keep=True)
 
-            if (tile.type in AUTOTILE_TYPES) and (neighbors in AUTOTILE_MAP):
-                tile.var = AUTOTILE_MAP[neighbors]
+    def automap(self):
+        self.autotiler.automap()
 
     def render(self):
-        # Offgrid tiles are often rendered as decorations, therefor we should
-        # render them first so that they are applied behind the grid.
-        for tile in self.offgrid:
-            self.game.fore_d.blit(self.game.assets.get_tiles(tile.type, tile.var), tile.pos.sub(self.game.render_scroll).tuple())
-
-        # Optimization to only render tiles that are visible.
-        top_left_tile = self.game.render_scroll.div_f(self.size)
-        # Add one to compensate for rounding errors.
-        top_right_tile = (self.game.render_scroll.add(self.game.fore_d.get_size()).div_f(self.size).add((1, 1)))
-
-        for x in range(top_left_tile.x, top_right_tile.x):
-            for y in range(top_left_tile.y, top_right_tile.y):
-                loc = f'{x};{y}'
-
-                if loc in self.tilemap:
-                    tile = self.tilemap[loc]
-                    self.game.fore_d.blit(self.game.assets.get_tiles(tile.type, tile.var),
-                                          tile.pos.mult(self.size).sub(self.game.render_scroll).tuple())
-
-    def physics_rects_around(self, pos=Vec2((0, 0))):
+        # Tiles are baked into one surface per chunk, so only the chunks that
+        # intersect the camera cost a blit.
+        self.cache.render(self.game.fore_d, offset=self.game.camera.render_scroll,
+                          outline_surf=self.game.back_d if self.game.outline_cached else None)
+
+    def raycast(self, start, end):
+        # Walks the cells along the segment (DDA) and returns the point where
+        # it first enters a solid cell, or None when nothing is in the way.
+        size = self.size
+        is_solid = self.is_solid
+        x0, y0 = start
+        dx = end[0] - x0
+        dy = end[1] - y0
+        cell_x = int(x0 // size)
+        cell_y = int(y0 // size)
+
+        if is_solid(cell_x, cell_y):
+            return Vec2((x0, y0))
+
+        step_x = 1 if dx > 0 else -1
+        step_y = 1 if dy > 0 else -1
+        # Distances, as fractions of the segment, to the next cell border
+        # and between borders on each axis.
+        delta_x = size / abs(dx) if dx else math.inf
+        delta_y = size / abs(dy) if dy else math.inf
+        next_x = (((cell_x + 1) * size - x0) if dx > 0 else (x0 - cell_x * size)) * delta_x / size if dx else math.inf
+        next_y = (((cell_y + 1) * size - y0) if dy > 0 else (y0 - cell_y * size)) * delta_y / size if dy else math.inf
+
+        while True:
+            if next_x < next_y:
+                t = next_x
+                cell_x += step_x
+                next_x += delta_x
+            else:
+                t = next_y
+                cell_y += step_y
+                next_y += delta_y
+
+            if t > 1:
+                return None
+
+            if is_solid(cell_x, cell_y):
+                return Vec2((x0 + dx * t, y0 + dy * t))
+
+    def raycast_batch(self, rays):
+        # Casts many (start, end) rays at once, the results are the same as
+        # those of raycast() and in the same order. Every chunk the rays can
+        # reach is looked up once for all of them, and the cells of every
+        # ray are checked against those chunks at once.
+        if len(rays) < RAYCAST_BATCH:
+            return tuple(self.raycast(start, end) for start, end in rays)
+
+        size = self.size
+        x0, y0, x1, y1 = np.array([(start[0], start[1], end[0], end[1]) for start, end in rays], dtype=float).T
+        dx = x1 - x0
+        dy = y1 - y0
+        cell_x = (x0 // size).astype(np.intp)
+        cell_y = (y0 // size).astype(np.intp)
+        # Rays only visit cells up to one past the cells of their ends, the
+        # chunks around those are stacked into one array of solidity. table
+        # maps chunk coordinates onto its rows, row 0 stands in for chunks
+        # that are not loaded.
+        left = (np.minimum(cell_x, x1 // size).astype(np.intp) - 1) >> CHUNK_SHIFT
+        right = (np.maximum(cell_x, x1 // size).astype(np.intp) + 1) >> CHUNK_SHIFT
+        top = (np.minimum(cell_y, y1 // size).astype(np.intp) - 1) >> CHUNK_SHIFT
+        bottom = (np.maximum(cell_y, y1 // size).astype(np.intp) + 1) >> CHUNK_SHIFT
+        origin_x = int(left.min())
+        origin_y = int(top.min())
+        table = np.zeros((int(bottom.max()) - origin_y + 1, int(right.max()) - origin_x + 1), dtype=np.intp)
+        span_y, span_x = np.indices((int((bottom - top).max()) + 1, int((right - left).max()) + 1)).reshape(2, -1)
+        keys_x = left[:, None] + span_x
+        keys_y = top[:, None] + span_y
+        within = (keys_x <= right[:, None]) & (keys_y <= bottom[:, None])
+        keys = np.unique((keys_y[within] - origin_y) * table.shape[1] + keys_x[within] - origin_x)
+        solids = np.zeros((len(keys) + 1, CHUNK_AREA), dtype=bool)
+
+        for row, key in enumerate(keys.tolist(), 1):
+            chunk = self.get_chunk((origin_x + key % table.shape[1], origin_y + key // table.shape[1]))
+
+            if chunk is not None:
+                solids[row] = np.frombuffer(chunk.solid, dtype=np.uint8)
+                table.flat[key] = row
+
+        def is_solid(cell_x, cell_y):
+            rows = table[(cell_y >> CHUNK_SHIFT) - origin_y, (cell_x >> CHUNK_SHIFT) - origin_x]
+
+            return solids[rows, ((cell_y & CHUNK_MASK) << CHUNK_SHIFT) | (cell_x & CHUNK_MASK)]
+
+        # The same steps as raycast(), on every ray at once. Every border a
+        # ray crosses is one step, the steps are added up like raycast()
+        # does so that they land on the same fractions of the segment.
+        count_x = int(np.abs(x1 // size - cell_x).max()) + 1
+        count_y = int(np.abs(y1 // size - cell_y).max()) + 1
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta_x = np.where(dx != 0, size / np.abs(dx), np.inf)
+            delta_y = np.where(dy != 0, size / np.abs(dy), np.inf)
+            next_x = np.where(dx != 0, np.where(dx > 0, (cell_x + 1) * size - x0, x0 - cell_x * size) * delta_x / size,
+                              np.inf)
+            next_y = np.where(dy != 0, np.where(dy > 0, (cell_y + 1) * size - y0, y0 - cell_y * size) * delta_y / size,
+                              np.inf)
+
+        steps_x = np.repeat(delta_x[:, None], count_x, axis=1)
+        steps_x[:, 0] = next_x
+        steps_y = np.repeat(delta_y[:, None], count_y, axis=1)
+        steps_y[:, 0] = next_y
+        # Steps of both axes in the order they are taken, after the cell the
+        # ray starts in. A step along y goes first when both borders are
+        # crossed at once.
+        t = np.concatenate((np.zeros((len(dx), 1)), np.cumsum(steps_y, axis=1), np.cumsum(steps_x, axis=1)), axis=1)
+        order = np.argsort(t, axis=1, kind='stable')
+        t = np.take_along_axis(t, order, axis=1)
+        along_x = order > count_y
+        along_y = (order > 0) & ~along_x
+        cells_x = cell_x[:, None] + np.where(dx > 0, 1, -1)[:, None] * np.cumsum(along_x, axis=1)
+        cells_y = cell_y[:, None] + np.where(dy > 0, 1, -1)[:, None] * np.cumsum(along_y, axis=1)
+        inside = t <= 1
+        hit = np.zeros(t.shape, dtype=bool)
+        hit[inside] = is_solid(cells_x[inside], cells_y[inside])
+        hits = hit.any(axis=1)
+        hit_t = np.where(hits, t[np.arange(len(t)), hit.argmax(axis=1)], 0)
+
+        return tuple(Vec2((x, y)) if hit else None
+                     for x, y, hit in zip((x0 + dx * hit_t).tolist(), (y0 + dy * hit_t).tolist(), hits.tolist()))
+
+    def impact_frame(self, pos, vel, limit):
+        # The first step at which a point moving by vel every step is inside
+        # a solid cell, or None if that doesn't happen within limit steps.
+        speed = math.hypot(*vel)
+
+        if not speed:
+            return None
+
+        hit = self.raycast(pos, (pos[0] + vel[0] * limit, pos[1] + vel[1] * limit))
+
+        if hit is None:
+            return None
+
+        # The hit point lies on a cell border, so nudge forward until the
+        # stepped position is inside the cell as well.
+        step = max(1, int(math.hypot(hit.x - pos[0], hit.y - pos[1]) / speed))
+
+        while step <= limit and not self.solid_check((pos[0] + vel[0] * step, pos[1] + vel[1] * step)):
+            step += 1
+
+        return step if step <= limit else None
+
+    def solid_rects(self, rect):
+        # Merged collision rects (in pixels) of every chunk overlapping the
+        # rect that collide with it. Runs of solid tiles come back as a few
+        # large rects instead of one rect per tile, but runs are still split
+        # at chunk borders.
+        rect = pygame.Rect(rect)
+        size = self.size
         rects = []
 
-        for tile in self.tiles_around(pos):
-            if tile.type in PHYSICS_TILES:
-                rects.append(pygame.Rect(*tile.pos.mult(self.size), self.size, self.size))
+        for cx in range((rect.left // size) >> CHUNK_SHIFT, ((rect.right - 1) // size >> CHUNK_SHIFT) + 1):
+            for cy in range((rect.top // size) >> CHUNK_SHIFT, ((rect.bottom - 1) // size >> CHUNK_SHIFT) + 1):
+                chunk = self.get_chunk((cx, cy))
+
+                if chunk is None:
+                    continue
+
+                base_x = (cx << CHUNK_SHIFT) * size
+                base_y = (cy << CHUNK_SHIFT) * size
+
+                for x, y, width, height in chunk.solid_rects():
+                    solid_r = pygame.Rect(base_x + x * size, base_y + y * size, width * size, height * size)
+
+                    if solid_r.colliderect(rect):
+                        rects.append(solid_r)
 
         return tuple(rects)
 
@@ -152,12 +649,13 @@ class Tilemap:
         tiles = []
         # Using this formula ensures correct index. Otherwise, we may get
         # rounding errors or extra digits.
-        tile_loc = pos.div_f(self.size).int()
+        tile_x = int(pos[0] // self.size)
+        tile_y = int(pos[1] // self.size)
 
         for offset in NEIGHBOR_OFFSETS:
-            check_loc = tile_loc.add(offset).json()
+            tile = self.get_tile(tile_x + offset.x, tile_y + offset.y)
 
-            if check_loc in self.tilemap:
-                tiles.append(self.tilemap[check_loc])
+            if tile:
+                tiles.append(tile)
 
         return tuple(tiles)
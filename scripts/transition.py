@@ -0,0 +1,63 @@
+from abc import ABC, abstractmethod
+
+import pygame
+
+from scripts.render_queue import Layer
+from scripts.utils import make_outline
+
+
+class Transition(ABC):
+    def __init__(self, size, length=30):
+        self.size = size
+        # Steps run from 0, fully open, up to length, fully closed.
+        self.length = length
+
+    @abstractmethod
+    def frame(self, step):
+        raise NotImplementedError
+
+    def render(self, game, step):
+        game.queue.push(Layer.TRANSITION, game.fore_d, self.frame(min(step, self.length)), (0, 0))
+
+
+class CircleWipe(Transition):
+    def __init__(self, size, length=30, speed=8):
+        super().__init__(size, length)
+        self.speed = speed
+        # Every step is drawn once up front, rather than every frame the
+        # transition is shown.
+        self.frames = tuple(self.make_frame(step) for step in range(length + 1))
+
+    def make_frame(self, step):
+        surf = pygame.Surface(self.size, pygame.SRCALPHA)
+        surf.fill((0, 0, 0))
+        pygame.draw.circle(
+            surface=surf,
+            color=(0, 0, 0, 0),
+            center=(self.size[0] // 2, self.size[1] // 2),
+            radius=(self.length - step) * self.speed)
+        # The outline around the opening is drawn into the frame itself, so
+        # that it is built here with the frame and not cached on first use.
+        frame = make_outline(surf).subsurface((1, 1), self.size).copy()
+        frame.blit(surf, (0, 0))
+        # The frames only hold long runs of a few colors, which run-length
+        # encoding blits quickly.
+        frame.set_alpha(255, pygame.RLEACCEL)
+
+        return frame
+
+    def frame(self, step):
+        return self.frames[step]
+
+
+class Fade(Transition):
+    def __init__(self, size, length=30, color=(0, 0, 0)):
+        super().__init__(size, length)
+        # One surface is reused, only its alpha changes between steps.
+        self.surf = pygame.Surface(size)
+        self.surf.fill(color)
+
+    def frame(self, step):
+        self.surf.set_alpha(255 * step // self.length)
+
+        return self.surf
@@ -4,6 +4,7 @@ from abc import ABC, abstractmethod
 import pygame
 
 BASE_IMG_PATH = 'data/images/'
+SILHOUETTE_OFFSETS = ((-1, 0), (1, 0), (0, -1), (0, 1))
 
 
 def get_rects(game, type, var, keep, size=(0, 0), offset=(0, 0)):
@@ -15,7 +16,12 @@ def get_rects(game, type, var, keep, size=(0, 0), offset=(0, 0)):
     return tuple(spawns)
 
 
-def load_image(path):
+def load_image(path, cache=None):
+    # Images come out of the image cache when there is one, which skips
+    # decoding the PNG while it is unchanged.
+    if cache is not None:
+        return cache.load(BASE_IMG_PATH + path, colorkey=(0, 0, 0))
+
     # Using .convert() converts the internal representation of the image to
     # make it more efficient for rendering.
     img = pygame.image.load(BASE_IMG_PATH + path).convert()
@@ -26,41 +32,90 @@ def load_image(path):
     return img
 
 
-def load_images(path):
-    images = []
+def decode_image(path, cache):
+    # Only decodes the image into the cache and reads out its pixels, unlike
+    # load_image() this is safe to do off the main thread.
+    cache.stage(BASE_IMG_PATH + path, colorkey=(0, 0, 0))
+
+
+def image_paths(path):
+    # Single images are files, animations and sets of tiles are directories
+    # of images.
+    if os.path.isfile(BASE_IMG_PATH + path):
+        return (path,)
 
     # os.listdir() may not work on Linux. Using sorted should make this
     # consistent across all platforms.
-    for img_name in sorted(os.listdir(BASE_IMG_PATH + path)):
-        images.append(load_image(path + '/' + img_name))
+    return tuple(path + '/' + img_name for img_name in sorted(os.listdir(BASE_IMG_PATH + path)))
 
-    return tuple(images)
 
+def load_images(path, cache=None):
+    return tuple(load_image(img_path, cache) for img_path in image_paths(path))
 
-class Anim:
-    def __init__(self, images, img_dur=5, loop=True):
+
+def flip_image(img):
+    # Mirrors the image horizontally, which is the direction entities face.
+    return pygame.transform.flip(img, True, False)
+
+
+def make_outline(img, color=(0, 0, 0, 180)):
+    # The outline is one pixel larger on every side than the image, and is
+    # meant to be drawn behind it at an offset of (-1, -1).
+    silhouette = pygame.mask.from_surface(img).to_surface(setcolor=color, unsetcolor=(0, 0, 0, 0))
+    outline = pygame.Surface((img.get_width() + 2, img.get_height() + 2), pygame.SRCALPHA)
+
+    for offset in SILHOUETTE_OFFSETS:
+        outline.blit(silhouette, (1 + offset[0], 1 + offset[1]))
+
+    return outline
+
+
+class AnimData:
+    # The images and timing of an animation. Shared by everything that plays
+    # it, and never changed after it is built.
+    __slots__ = ('images', 'flipped', 'img_dur', 'loop', 'frame_max', 'wrap', 'indexes', 'frames', 'flipped_frames')
+
+    def __init__(self, images, img_dur=5, loop=True, flipped=None):
         self.images = images
+        # Mirrored frames are built once and shared by every playhead.
+        self.flipped = flipped if flipped is not None else tuple(flip_image(img) for img in images)
         self.img_dur = img_dur
         self.loop = loop
-        self.done = False
-        self.frame = 0
         self.frame_max = img_dur * len(images) - 1
+        # Frames advance modulo wrap, which only reaches frame_max when the
+        # animation does not loop.
+        self.wrap = self.frame_max if loop else self.frame_max + 1
+        # The image index and the image itself for every frame, so that
+        # looking them up is a single read.
+        self.indexes = tuple(frame // img_dur for frame in range(self.frame_max + 1))
+        self.frames = tuple(self.images[index] for index in self.indexes)
+        self.flipped_frames = tuple(self.flipped[index] for index in self.indexes)
 
-    def deepcopy(self):
-        return Anim(self.images, self.img_dur, self.loop)
+
+class Anim:
+    # A playhead over shared AnimData, holding only the state of one
+    # playback.
+    __slots__ = ('data', 'frame', 'done')
+
+    def __init__(self, data):
+        self.data = data
+        self.frame = 0
+        self.done = False
 
     def update(self):
-        if self.loop:
+        data = self.data
+
+        if data.loop:
             # Loops the frame using modulo.
-            self.frame = (self.frame + 1) % self.frame_max
+            self.frame = (self.frame + 1) % data.frame_max
         else:
-            self.frame = min(self.frame + 1, self.frame_max)
+            self.frame = min(self.frame + 1, data.frame_max)
 
-            if self.frame >= self.frame_max:
+            if self.frame >= data.frame_max:
                 self.done = True
 
-    def img(self):
-        return self.images[int(self.frame / self.img_dur)]
+    def img(self, flip=False):
+        return (self.data.flipped_frames if flip else self.data.frames)[self.frame]
 
 
 class Dir: